@@ -0,0 +1,100 @@
+# backend/benchmarks/bench_boxes.py
+#
+# Micro-benchmark for the box post-processing in core/boxes.py against the
+# original pure-Python versions, for 10 to 5000 boxes on a 12MP frame.
+# Run from backend/:  python -m benchmarks.bench_boxes [--sizes 10 100 1000 5000]
+
+import argparse
+import json
+import statistics
+import time
+
+import numpy as np
+
+from core.boxes import iou, merge_overlaps, polygons_to_boxes, union_masks
+
+
+def legacy_merge_overlaps(boxes, iou_thresh=0.2):
+    boxes = boxes.tolist()
+    merged = []
+    while boxes:
+        b = boxes.pop(0)
+        group = [b]
+        rest = []
+        for c in boxes:
+            if iou(b, c) > iou_thresh:
+                group.append(c)
+            else:
+                rest.append(c)
+        merged.append([min(t[0] for t in group), min(t[1] for t in group),
+                       max(t[2] for t in group), max(t[3] for t in group)])
+        boxes = rest
+    return np.array(merged, dtype=int)
+
+
+def legacy_polygons_to_boxes(polygons):
+    boxes = []
+    for points in polygons:
+        x_coords = [p[0] for p in points]
+        y_coords = [p[1] for p in points]
+        boxes.append([min(x_coords), min(y_coords), max(x_coords), max(y_coords)])
+    return np.array(boxes)
+
+
+def legacy_union_masks(img_shape, list_of_boxes_lists):
+    mask = np.zeros(img_shape[:2], dtype=np.uint8)
+    for boxes in list_of_boxes_lists:
+        for box in boxes:
+            x1, y1, x2, y2 = [int(v) for v in box]
+            mask[y1:y2, x1:x2] = 1
+    return mask
+
+
+def random_text_boxes(n, height, width, rng):
+    # Short, wide boxes clustered like lines of text on shopfronts
+    x = rng.integers(0, width - 50, n)
+    y = rng.integers(0, height - 50, n)
+    w = rng.integers(10, 240, n)
+    h = rng.integers(8, 60, n)
+    return np.stack([x, y, np.minimum(x + w, width), np.minimum(y + h, height)], axis=1)
+
+
+def timeit(fn, repeats):
+    times = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        fn()
+        times.append((time.perf_counter() - start) * 1000)
+    return round(statistics.median(times), 3)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark vectorized box post-processing.")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10, 50, 100, 500, 1000, 2000, 5000])
+    parser.add_argument("--height", type=int, default=3000)
+    parser.add_argument("--width", type=int, default=4000)
+    parser.add_argument("--repeats", type=int, default=5)
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(0)
+    shape = (args.height, args.width)
+    rows = []
+    for n in args.sizes:
+        boxes = random_text_boxes(n, args.height, args.width, rng)
+        polys = [[[x1, y1], [x2, y1], [x2, y2], [x1, y2]] for x1, y1, x2, y2 in boxes.tolist()]
+        # The legacy merge is quadratic in Python; one run is plenty at the large sizes
+        legacy_repeats = args.repeats if n <= 1000 else 1
+        rows.append({
+            "boxes": n,
+            "merge_legacy_ms": timeit(lambda: legacy_merge_overlaps(boxes), legacy_repeats),
+            "merge_ms": timeit(lambda: merge_overlaps(boxes), args.repeats),
+            "polygons_legacy_ms": timeit(lambda: legacy_polygons_to_boxes(polys), args.repeats),
+            "polygons_ms": timeit(lambda: polygons_to_boxes(polys), args.repeats),
+            "mask_legacy_ms": timeit(lambda: legacy_union_masks(shape, [boxes]), args.repeats),
+            "mask_ms": timeit(lambda: union_masks(shape, [boxes]), args.repeats),
+        })
+        print(json.dumps(rows[-1]))
+
+
+if __name__ == "__main__":
+    main()
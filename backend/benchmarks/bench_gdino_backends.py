@@ -0,0 +1,103 @@
+# backend/benchmarks/bench_gdino_backends.py
+#
+# Accuracy and latency of each Grounding DINO backend against the eager fp32 model
+# on a fixed local image set. Boxes from a backend count as matching the baseline
+# when their IoU is at least --match-iou; the run fails (exit 1) if any backend's
+# recall against the baseline drops below --min-recall.
+# Run from backend/:  python -m benchmarks.bench_gdino_backends --backends int8 compile onnx
+
+import argparse
+import glob
+import json
+import statistics
+import sys
+import time
+
+import numpy as np
+import torch
+from PIL import Image
+from transformers import AutoProcessor, AutoModelForZeroShotObjectDetection
+
+from core.backends import BACKENDS, apply_backend
+from core.boxes import pairwise_iou
+from core.pipeline import DEFAULT_QUERIES as QUERIES
+from core.prompts import prompt_text
+from core.redactor import detect_gdino
+
+MODEL_ID = "IDEA-Research/grounding-dino-base"
+
+
+def run_backend(backend, images, processor, device, repeats, onnx_path):
+    model = AutoModelForZeroShotObjectDetection.from_pretrained(MODEL_ID).to(device).eval()
+    sample = processor(images=images[0], text="street name sign. flag.", return_tensors="pt")
+    check = processor(images=images[-1], text=prompt_text(QUERIES), return_tensors="pt")
+    model, active = apply_backend(model, backend, device, onnx_path, sample, check)
+    boxes, times = [], []
+    for img in images:
+        detect_gdino(img, processor, model, device, 0.25, 0.20, QUERIES)  # warm up
+        per_image = []
+        for _ in range(repeats):
+            start = time.perf_counter()
+            b, _, _ = detect_gdino(img, processor, model, device, 0.25, 0.20, QUERIES)
+            per_image.append((time.perf_counter() - start) * 1000)
+        boxes.append(b)
+        times.append(statistics.median(per_image))
+    return active, boxes, times
+
+
+def match_stats(reference, candidate, match_iou):
+    if len(reference) == 0 and len(candidate) == 0:
+        return {"recall": 1.0, "precision": 1.0, "mean_iou": 1.0}
+    if len(reference) == 0 or len(candidate) == 0:
+        return {"recall": float(len(reference) == 0), "precision": float(len(candidate) == 0), "mean_iou": 0.0}
+    ious = pairwise_iou(reference, candidate)
+    best_ref = ious.max(axis=1)
+    return {
+        "recall": float((best_ref >= match_iou).mean()),
+        "precision": float((ious.max(axis=0) >= match_iou).mean()),
+        "mean_iou": float(best_ref.mean()),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare Grounding DINO backends against eager fp32.")
+    parser.add_argument("--images", default="../assets/*.jpg", help="Glob of the fixed image set")
+    parser.add_argument("--backends", nargs="+", default=["int8", "compile", "onnx"], choices=BACKENDS)
+    parser.add_argument("--repeats", type=int, default=3)
+    parser.add_argument("--match-iou", type=float, default=0.5)
+    parser.add_argument("--min-recall", type=float, default=0.9)
+    parser.add_argument("--onnx-path", default="gdino.onnx")
+    parser.add_argument("--device", default="cpu")
+    args = parser.parse_args()
+
+    paths = sorted(glob.glob(args.images))
+    if not paths:
+        sys.exit(f"No images match {args.images}")
+    images = [Image.open(p).convert("RGB") for p in paths]
+    processor = AutoProcessor.from_pretrained(MODEL_ID)
+    torch.manual_seed(0)
+
+    _, baseline, baseline_times = run_backend("eager", images, processor, args.device, args.repeats, None)
+    report = {"images": paths, "device": args.device,
+              "eager": {"median_ms": round(statistics.median(baseline_times), 1)}}
+    failed = False
+    for backend in args.backends:
+        active, boxes, times = run_backend(backend, images, processor, args.device, args.repeats, args.onnx_path)
+        stats = [match_stats(ref, cand, args.match_iou) for ref, cand in zip(baseline, boxes)]
+        entry = {
+            "active_backend": active,
+            "median_ms": round(statistics.median(times), 1),
+            "speedup": round(statistics.median(baseline_times) / statistics.median(times), 2),
+            "recall": round(float(np.mean([s["recall"] for s in stats])), 3),
+            "precision": round(float(np.mean([s["precision"] for s in stats])), 3),
+            "mean_iou": round(float(np.mean([s["mean_iou"] for s in stats])), 3),
+        }
+        entry["passed"] = active == backend and entry["recall"] >= args.min_recall
+        failed = failed or not entry["passed"]
+        report[backend] = entry
+    print(json.dumps(report, indent=2))
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
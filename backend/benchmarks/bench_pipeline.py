@@ -0,0 +1,228 @@
+# backend/benchmarks/bench_pipeline.py
+#
+# Per-stage and end-to-end benchmark of the redaction pipeline:
+# detection copy -> full decode -> Grounding DINO -> OCR -> mask -> redact -> JPEG encode,
+# with both decodes going through core.ingest the way server requests do.
+#
+# By default the two detectors are stubs that return random boxes, so the
+# OpenCV/NumPy stages can be measured on any Linux box without torch or model
+# weights; --detectors real loads the actual models.
+#
+# Run from backend/:
+#   python -m benchmarks.bench_pipeline --output run.json
+#   python -m benchmarks.bench_pipeline --compare base.json run.json --tolerance 0.15
+
+import argparse
+import glob
+import json
+import os
+import platform
+import resource
+import sys
+import time
+
+import cv2
+import numpy as np
+
+from core import ingest
+from core.boxes import union_masks
+from core.imaging import redact, rescale_boxes
+
+STAGES = ["detect_copy", "decode", "gdino", "ocr", "mask", "redact", "encode", "end_to_end"]
+DEFAULT_RESOLUTIONS = ["640x480", "1920x1080", "4032x3024"]
+DEFAULT_BOX_COUNTS = [0, 10, 100, 1000]
+
+
+def synthetic_jpeg(width, height, seed=0):
+    # Smooth noise plus edges: compresses and blurs roughly like a photo, unlike pure noise
+    rng = np.random.default_rng(seed)
+    small = rng.integers(0, 255, (max(1, height // 16), max(1, width // 16), 3), dtype=np.uint8)
+    img = cv2.resize(small, (width, height), interpolation=cv2.INTER_CUBIC)
+    for _ in range(20):
+        x, y = int(rng.integers(0, width)), int(rng.integers(0, height))
+        cv2.putText(img, "BLK 123", (x, y), cv2.FONT_HERSHEY_SIMPLEX, max(1.0, width / 1000), (255, 255, 255), 3)
+    return cv2.imencode(".jpg", img, [cv2.IMWRITE_JPEG_QUALITY, 90])[1].tobytes()
+
+
+def random_boxes(n, height, width, rng):
+    x = rng.integers(0, max(1, width - 20), n)
+    y = rng.integers(0, max(1, height - 20), n)
+    w = rng.integers(10, max(11, width // 8), n)
+    h = rng.integers(10, max(11, height // 12), n)
+    return np.stack([x, y, np.minimum(x + w, width), np.minimum(y + h, height)], axis=1).reshape(-1, 4)
+
+
+class StubDetectors:
+    """Stands in for Grounding DINO and OCR: returns n_boxes random boxes, split between the two."""
+
+    def __init__(self, seed=0):
+        self.rng = np.random.default_rng(seed)
+
+    def gdino(self, img_det, n_boxes):
+        h, w = img_det.shape[:2]
+        return random_boxes(n_boxes // 2, h, w, self.rng)
+
+    def ocr(self, img_det, n_boxes):
+        h, w = img_det.shape[:2]
+        return random_boxes(n_boxes - n_boxes // 2, h, w, self.rng)
+
+
+class RealDetectors:
+    """The actual models; box counts come from the image, n_boxes is ignored."""
+
+    def __init__(self):
+        from core.pipeline import RedactionPipeline, DEFAULT_QUERIES
+        self.pipeline = RedactionPipeline(use_geoclip=False).load()
+        self._to_pil, self._queries = ingest.to_pil, DEFAULT_QUERIES
+
+    def gdino(self, img_det, n_boxes):
+        boxes, _, _ = self.pipeline.detect_gdino(self._to_pil(img_det), self._queries)
+        return boxes
+
+    def ocr(self, img_det, n_boxes):
+        return self.pipeline.detect_ocr(img_det)
+
+
+def current_rss_mb():
+    with open("/proc/self/statm") as f:
+        return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / 2**20
+
+
+def peak_rss_mb():
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024  # ru_maxrss is KiB on Linux
+
+
+def run_once(image_bytes, n_boxes, detectors, method, detect_max_side):
+    t = {}
+    start = mark = time.perf_counter()
+
+    def lap(name):
+        nonlocal mark
+        now = time.perf_counter()
+        t[name] = (now - mark) * 1000
+        mark = now
+
+    # Same order as RedactionPipeline.detect_async: the (reduced) detection-copy decode
+    # first, then the full-resolution one, skipped when the copy already is the whole image
+    img_det, is_full_res = ingest.load_image_for_detection(image_bytes, detect_max_side)
+    lap("detect_copy")
+    img_bgr = img_det if is_full_res else ingest.load_image(image_bytes)
+    lap("decode")
+    boxes_gd = detectors.gdino(img_det, n_boxes)
+    lap("gdino")
+    boxes_ocr = detectors.ocr(img_det, n_boxes)
+    lap("ocr")
+    boxes = [rescale_boxes(b, img_det.shape, img_bgr.shape) for b in (boxes_gd, boxes_ocr)]
+    mask = union_masks(img_bgr.shape, boxes)
+    lap("mask")
+    redacted = redact(img_bgr, mask, method=method)
+    lap("redact")
+    cv2.imencode(".jpg", redacted, [cv2.IMWRITE_JPEG_QUALITY, 90])
+    lap("encode")
+    t["end_to_end"] = (time.perf_counter() - start) * 1000
+    return t
+
+
+def percentiles(values):
+    arr = np.asarray(values)
+    return {p: round(float(np.percentile(arr, q)), 3) for p, q in (("p50", 50), ("p90", 90), ("p99", 99))}
+
+
+def benchmark(args):
+    detectors = RealDetectors() if args.detectors == "real" else StubDetectors(seed=0)
+    inputs = []
+    for res in args.resolutions:
+        w, h = (int(v) for v in res.lower().split("x"))
+        inputs.append((f"synthetic_{w}x{h}", synthetic_jpeg(w, h)))
+    for path in sorted(glob.glob(args.images)) if args.images else []:
+        with open(path, "rb") as f:
+            inputs.append((os.path.basename(path), f.read()))
+
+    cases = []
+    for name, image_bytes in inputs:
+        box_counts = args.box_counts if args.detectors == "stub" else [None]
+        for n_boxes in box_counts:
+            for _ in range(args.warmup):
+                run_once(image_bytes, n_boxes or 0, detectors, args.method, args.detect_max_side)
+            runs = []
+            start = time.perf_counter()
+            for _ in range(args.repeats):
+                runs.append(run_once(image_bytes, n_boxes or 0, detectors, args.method, args.detect_max_side))
+            elapsed = time.perf_counter() - start
+            case = {
+                "image": name,
+                "boxes": n_boxes,
+                "stages_ms": {stage: percentiles([r[stage] for r in runs]) for stage in STAGES},
+                "throughput_img_s": round(args.repeats / elapsed, 3),
+                "rss_mb": round(current_rss_mb(), 1),
+                "peak_rss_mb": round(peak_rss_mb(), 1),
+            }
+            cases.append(case)
+            print(f"{name} boxes={n_boxes}: end_to_end p50 {case['stages_ms']['end_to_end']['p50']} ms",
+                  file=sys.stderr)
+    return {
+        "meta": {
+            "detectors": args.detectors, "method": args.method, "repeats": args.repeats,
+            "detect_max_side": args.detect_max_side, "python": platform.python_version(),
+            "opencv": cv2.__version__, "numpy": np.__version__, "machine": platform.machine(),
+            "cpus": os.cpu_count(),
+        },
+        "cases": cases,
+        "peak_rss_mb": round(peak_rss_mb(), 1),
+    }
+
+
+def compare(base_path, new_path, tolerance, metric="p50"):
+    """Lists every (image, boxes, stage) whose metric got slower by more than tolerance (a fraction)."""
+    with open(base_path) as f:
+        base = {(c["image"], c["boxes"]): c for c in json.load(f)["cases"]}
+    with open(new_path) as f:
+        new = {(c["image"], c["boxes"]): c for c in json.load(f)["cases"]}
+    rows = []
+    for key in sorted(set(base) & set(new), key=str):
+        for stage in STAGES:
+            old_ms = base[key]["stages_ms"][stage][metric]
+            new_ms = new[key]["stages_ms"][stage][metric]
+            # Ignore sub-millisecond stages, where timer noise dominates
+            change = (new_ms - old_ms) / old_ms if old_ms >= 1.0 else 0.0
+            rows.append({"image": key[0], "boxes": key[1], "stage": stage, "base_ms": old_ms, "new_ms": new_ms,
+                         "change": round(change, 3), "regression": change > tolerance})
+    return {"metric": metric, "tolerance": tolerance, "rows": rows,
+            "regressions": [r for r in rows if r["regression"]],
+            "missing_cases": [list(k) for k in set(base) ^ set(new)]}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the redaction pipeline stage by stage.")
+    parser.add_argument("--detectors", choices=["stub", "real"], default="stub")
+    parser.add_argument("--resolutions", nargs="*", default=DEFAULT_RESOLUTIONS, help="Synthetic images, WxH")
+    parser.add_argument("--images", default="../assets/unblurred.jpg", help="Glob of bundled images to include")
+    parser.add_argument("--box-counts", type=int, nargs="+", default=DEFAULT_BOX_COUNTS,
+                        help="Boxes returned by the stub detectors")
+    parser.add_argument("--method", choices=["blur", "pixelate"], default="blur")
+    parser.add_argument("--detect-max-side", type=int, default=1333)
+    parser.add_argument("--repeats", type=int, default=10)
+    parser.add_argument("--warmup", type=int, default=1)
+    parser.add_argument("--output", help="Write the JSON report here instead of stdout")
+    parser.add_argument("--compare", nargs=2, metavar=("BASE", "NEW"), help="Compare two reports and flag regressions")
+    parser.add_argument("--tolerance", type=float, default=0.15, help="Allowed slowdown before flagging, as a fraction")
+    parser.add_argument("--metric", choices=["p50", "p90", "p99"], default="p50")
+    args = parser.parse_args()
+
+    if args.compare:
+        result = compare(args.compare[0], args.compare[1], args.tolerance, args.metric)
+        status = 1 if result["regressions"] else 0
+    else:
+        result = benchmark(args)
+        status = 0
+    text = json.dumps(result, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(text + "\n")
+    else:
+        print(text)
+    sys.exit(status)
+
+
+if __name__ == "__main__":
+    main()
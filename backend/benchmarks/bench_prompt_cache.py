@@ -0,0 +1,71 @@
+# backend/benchmarks/bench_prompt_cache.py
+#
+# Measures what caching the Grounding DINO prompts saves per request.
+# Run from backend/:  python -m benchmarks.bench_prompt_cache [--image ../assets/unblurred.jpg]
+
+import argparse
+import json
+import statistics
+import time
+
+import torch
+from PIL import Image
+
+from core.prompts import PromptCache, install_text_feature_cache
+from core.pipeline import category_prompts
+from core.redactor import load_gdino
+
+
+def timeit(fn, repeats):
+    times = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        fn()
+        times.append((time.perf_counter() - start) * 1000)
+    return {"median_ms": round(statistics.median(times), 3), "min_ms": round(min(times), 3)}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark Grounding DINO prompt caching.")
+    parser.add_argument("--image", default="../assets/unblurred.jpg")
+    parser.add_argument("--repeats", type=int, default=10)
+    args = parser.parse_args()
+
+    device = "cuda" if torch.cuda.is_available() else "cpu"
+    processor, model = load_gdino(device)
+    image = Image.open(args.image).convert("RGB")
+    prompts = category_prompts()
+    prompt = prompts[-1]  # all four categories, the longest prompt
+    cache = PromptCache(processor.tokenizer, prompts)
+
+    report = {"device": device, "prompt": prompt}
+    # Preprocessing: full processor call vs. image-only preprocessing + cached tokens
+    report["preprocess_uncached"] = timeit(
+        lambda: processor(images=image, text=prompt, return_tensors="pt"), args.repeats)
+    report["preprocess_cached"] = timeit(
+        lambda: processor.image_processor(image, return_tensors="pt").update(cache([prompt])), args.repeats)
+    report["tokenize_only"] = timeit(
+        lambda: processor.tokenizer(prompt, return_tensors="pt"), args.repeats)
+
+    inputs = processor.image_processor(image, return_tensors="pt")
+    inputs.update(cache([prompt]))
+    inputs = inputs.to(device)
+    with torch.no_grad():
+        model(**inputs)  # warm up kernels before timing
+        report["forward_uncached"] = timeit(lambda: model(**inputs), args.repeats)
+        text_cache = install_text_feature_cache(model)
+        if text_cache is not None:
+            model(**inputs)  # fill the text feature cache
+            report["forward_text_cached"] = timeit(lambda: model(**inputs), args.repeats)
+        else:
+            report["forward_text_cached"] = None
+
+    saved = report["preprocess_uncached"]["median_ms"] - report["preprocess_cached"]["median_ms"]
+    if report["forward_text_cached"] is not None:
+        saved += report["forward_uncached"]["median_ms"] - report["forward_text_cached"]["median_ms"]
+    report["saved_per_request_ms"] = round(saved, 3)
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,177 @@
+# backend/core/backends.py
+#
+# Alternative inference backends for Grounding DINO, mainly for GPU-less nodes.
+
+import logging
+import os
+from types import SimpleNamespace
+
+import torch
+from transformers.models.grounding_dino import modeling_grounding_dino
+
+log = logging.getLogger(__name__)
+
+BACKENDS = ("eager", "int8", "compile", "onnx")
+
+# Inputs the exported ONNX graph takes, in order
+ONNX_INPUTS = ["pixel_values", "input_ids", "token_type_ids", "attention_mask", "pixel_mask",
+               "text_self_attention_masks", "position_ids"]
+
+# Largest difference from eager (boxes are normalized, scores are sigmoid probabilities)
+# a compiled or exported model may show in the smoke test
+SMOKE_TEST_ATOL = 1e-2
+
+
+def quantize_int8(model):
+    """Dynamic int8 quantization of every nn.Linear; weights are int8, activations quantized on the fly. CPU only."""
+    return torch.ao.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8)
+
+
+def compile_model(model):
+    if not hasattr(torch, "compile"):
+        raise RuntimeError("torch.compile needs PyTorch 2.0 or newer")
+    return torch.compile(model)
+
+
+def text_masks(input_ids):
+    """The text self-attention masks and position ids Grounding DINO derives from input_ids.
+
+    HF builds them with a Python loop over the positions of the special
+    tokens ("." and [SEP]), so tracing would bake the export prompt's
+    layout into the graph. The exported graph takes them as inputs instead
+    and OnnxGroundingDino computes them here for every call.
+    """
+    return modeling_grounding_dino.generate_masks_with_special_tokens_and_transfer_map(input_ids)
+
+
+class _ExportWrapper(torch.nn.Module):
+    # torch.onnx.export wants positional tensors in and a tuple of tensors out. The text
+    # masks come in as inputs: while tracing, HF's mask builder is swapped for one that
+    # returns them, so none of its prompt-dependent control flow ends up in the graph.
+    def __init__(self, model):
+        super().__init__()
+        self.model = model
+
+    def forward(self, pixel_values, input_ids, token_type_ids, attention_mask, pixel_mask,
+                text_self_attention_masks, position_ids):
+        build_masks = modeling_grounding_dino.generate_masks_with_special_tokens_and_transfer_map
+        modeling_grounding_dino.generate_masks_with_special_tokens_and_transfer_map = \
+            lambda _: (text_self_attention_masks, position_ids)
+        try:
+            out = self.model(pixel_values=pixel_values, input_ids=input_ids, token_type_ids=token_type_ids,
+                             attention_mask=attention_mask, pixel_mask=pixel_mask)
+        finally:
+            modeling_grounding_dino.generate_masks_with_special_tokens_and_transfer_map = build_masks
+        return out.logits, out.pred_boxes
+
+
+def export_onnx(model, sample_inputs, path, opset=17):
+    """Exports model to path, with batch, image size and prompt length left dynamic."""
+    dynamic_axes = {
+        "pixel_values": {0: "batch", 2: "height", 3: "width"},
+        "pixel_mask": {0: "batch", 1: "height", 2: "width"},
+        "input_ids": {0: "batch", 1: "tokens"},
+        "token_type_ids": {0: "batch", 1: "tokens"},
+        "attention_mask": {0: "batch", 1: "tokens"},
+        "text_self_attention_masks": {0: "batch", 1: "tokens", 2: "tokens"},
+        "position_ids": {0: "batch", 1: "tokens"},
+        "logits": {0: "batch", 2: "tokens"},
+        "pred_boxes": {0: "batch"},
+    }
+    inputs = {name: value.cpu() for name, value in sample_inputs.items()}
+    inputs["text_self_attention_masks"], inputs["position_ids"] = text_masks(inputs["input_ids"])
+    args = tuple(inputs[name] for name in ONNX_INPUTS)
+    with torch.no_grad():
+        torch.onnx.export(_ExportWrapper(model.cpu()).eval(), args, path, input_names=ONNX_INPUTS,
+                          output_names=["logits", "pred_boxes"], dynamic_axes=dynamic_axes, opset_version=opset)
+
+
+class OnnxGroundingDino:
+    """Runs an exported Grounding DINO graph with ONNX Runtime behind the model(**inputs) interface.
+
+    Returns an object with .logits and .pred_boxes, which is all
+    post_process_grounded_object_detection reads.
+    """
+
+    def __init__(self, path, device="cpu"):
+        import onnxruntime as ort
+        providers = ["CPUExecutionProvider"]
+        if device.startswith("cuda") and "CUDAExecutionProvider" in ort.get_available_providers():
+            providers.insert(0, "CUDAExecutionProvider")
+        options = ort.SessionOptions()
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        self.session = ort.InferenceSession(path, options, providers=providers)
+        self.input_names = {i.name for i in self.session.get_inputs()}
+        if "text_self_attention_masks" not in self.input_names:
+            raise RuntimeError(f"{path} was exported without text mask inputs and only handles its export "
+                               "prompt; delete it so it is exported again")
+
+    def eval(self):
+        return self
+
+    def __call__(self, **inputs):
+        inputs = dict(inputs)
+        inputs["text_self_attention_masks"], inputs["position_ids"] = text_masks(inputs["input_ids"])
+        feed = {name: inputs[name].cpu().numpy() for name in ONNX_INPUTS if name in self.input_names}
+        logits, pred_boxes = self.session.run(["logits", "pred_boxes"], feed)
+        return SimpleNamespace(logits=torch.from_numpy(logits), pred_boxes=torch.from_numpy(pred_boxes))
+
+
+def _smoke_test(model, reference, check_inputs, device):
+    # torch.compile and ONNX Runtime only fail once something runs through them, and a graph
+    # that froze its export prompt still runs, so compare against eager. reference=None
+    # (int8, which is not meant to match fp32 exactly) only checks that it runs.
+    inputs = {name: value.to(device) for name, value in check_inputs.items()}
+    with torch.no_grad():
+        out = model(**inputs)
+        if reference is None:
+            return
+        expected = reference(**inputs)
+    pairs = [("boxes", out.pred_boxes, expected.pred_boxes),
+             ("scores", out.logits.sigmoid(), expected.logits.sigmoid())]
+    for name, got, want in pairs:
+        diff = (got.float().cpu() - want.float().cpu()).abs().max().item()
+        if diff > SMOKE_TEST_ATOL:
+            raise RuntimeError(f"{name} differ from eager by up to {diff:.4f}")
+
+
+def apply_backend(model, backend, device="cpu", onnx_path=None, sample_inputs=None, check_inputs=None):
+    """Returns (model, backend actually in use).
+
+    If the requested backend cannot be set up here (no onnxruntime, old
+    torch, int8 asked for on a GPU, export failure...), logs why and falls
+    back to the eager fp32 model so the server still starts. sample_inputs
+    are what the ONNX graph is exported with. With check_inputs, the new
+    backend also runs them before it is accepted and, except for int8, must
+    match the eager model to within SMOKE_TEST_ATOL. Give check_inputs a
+    different prompt and image size than sample_inputs, or an export that
+    froze its sample prompt passes.
+    """
+    if backend not in BACKENDS:
+        log.warning("Unknown Grounding DINO backend '%s'; using eager. Choose from %s.", backend, BACKENDS)
+        return model, "eager"
+    if backend == "eager":
+        return model, "eager"
+    try:
+        if backend == "int8":
+            if device != "cpu":
+                raise RuntimeError("dynamic int8 quantization only runs on CPU")
+            wrapped = quantize_int8(model)
+        elif backend == "compile":
+            wrapped = compile_model(model)
+        else:
+            if not onnx_path:
+                raise RuntimeError("no ONNX path configured")
+            if not os.path.isfile(onnx_path):
+                if sample_inputs is None:
+                    raise RuntimeError(f"{onnx_path} does not exist and there are no sample inputs to export with")
+                log.info("Exporting Grounding DINO to %s...", onnx_path)
+                export_onnx(model, sample_inputs, onnx_path)
+                model.to(device)  # export ran it on the CPU
+            wrapped = OnnxGroundingDino(onnx_path, device)
+        if check_inputs is not None:
+            _smoke_test(wrapped, None if backend == "int8" else model, check_inputs, device)
+        return wrapped, backend
+    except Exception as e:
+        log.warning("Grounding DINO backend '%s' unavailable (%s); falling back to eager.", backend, e)
+        return model.to(device), "eager"
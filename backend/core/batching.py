@@ -0,0 +1,116 @@
+# backend/core/batching.py
+
+import asyncio
+import time
+
+
+class MicroBatcher:
+    """Collects concurrent requests into batches for a single batched call.
+
+    Callers ``await submit(item)``. A background task waits for the first item,
+    then keeps collecting until either ``max_batch_size`` items are queued or
+    ``max_wait_ms`` has passed, and hands the whole list to ``run_batch``.
+    ``run_batch`` must return one result per item, in order. It is a blocking
+    function and is run in ``executor`` (the default thread pool if None) so the
+    event loop keeps accepting requests while the model is busy.
+
+    ``on_wait``, if given, is called with the seconds each item spent queued
+    before its batch was handed to ``run_batch``.
+    """
+
+    def __init__(self, run_batch, max_batch_size=8, max_wait_ms=10.0, executor=None, on_wait=None):
+        if max_batch_size < 1:
+            raise ValueError("max_batch_size must be at least 1")
+        self.run_batch = run_batch
+        self.max_batch_size = max_batch_size
+        self.max_wait_ms = max_wait_ms
+        self.executor = executor
+        self.on_wait = on_wait
+        self._queue = None
+        self._worker = None
+        # Counters for metrics()
+        self._batches = 0
+        self._items = 0
+        self._last_batch_size = 0
+        self._max_queue_depth = 0
+        self._busy_seconds = 0.0
+
+    def _ensure_started(self):
+        if self._queue is None:
+            self._queue = asyncio.Queue()
+        if self._worker is None or self._worker.done():
+            self._worker = asyncio.get_running_loop().create_task(self._run())
+
+    async def submit(self, item):
+        self._ensure_started()
+        future = asyncio.get_running_loop().create_future()
+        await self._queue.put((item, future, time.monotonic()))
+        self._max_queue_depth = max(self._max_queue_depth, self._queue.qsize())
+        return await future
+
+    async def stop(self):
+        if self._worker is not None:
+            self._worker.cancel()
+            try:
+                await self._worker
+            except asyncio.CancelledError:
+                pass
+            self._worker = None
+
+    async def _collect(self):
+        batch = [await self._queue.get()]
+        deadline = time.monotonic() + self.max_wait_ms / 1000.0
+        while len(batch) < self.max_batch_size:
+            timeout = deadline - time.monotonic()
+            if timeout <= 0:
+                break
+            try:
+                batch.append(await asyncio.wait_for(self._queue.get(), timeout))
+            except asyncio.TimeoutError:
+                break
+        return batch
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = await self._collect()
+            # Drop requests whose caller has already gone away
+            batch = [(item, fut, queued) for item, fut, queued in batch if not fut.done()]
+            if not batch:
+                continue
+            items = [item for item, _, _ in batch]
+            start = time.monotonic()
+            if self.on_wait is not None:
+                for _, _, queued in batch:
+                    self.on_wait(start - queued)
+            try:
+                results = await loop.run_in_executor(self.executor, self.run_batch, items)
+                if len(results) != len(items):
+                    raise RuntimeError(f"run_batch returned {len(results)} results for {len(items)} items")
+            except Exception as e:
+                for _, fut, _ in batch:
+                    if not fut.done():
+                        fut.set_exception(e)
+            else:
+                for (_, fut, _), result in zip(batch, results):
+                    if not fut.done():
+                        fut.set_result(result)
+            finally:
+                self._busy_seconds += time.monotonic() - start
+                self._batches += 1
+                self._items += len(items)
+                self._last_batch_size = len(items)
+
+    def metrics(self):
+        return {
+            "queue_depth": self._queue.qsize() if self._queue is not None else 0,
+            "max_queue_depth": self._max_queue_depth,
+            "batches": self._batches,
+            "items": self._items,
+            "last_batch_size": self._last_batch_size,
+            "avg_batch_size": self._items / self._batches if self._batches else 0.0,
+            "avg_batch_fill": self._items / (self._batches * self.max_batch_size) if self._batches else 0.0,
+            "busy_seconds": round(self._busy_seconds, 3),
+            "max_batch_size": self.max_batch_size,
+            "max_wait_ms": self.max_wait_ms,
+        }
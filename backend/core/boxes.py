@@ -0,0 +1,185 @@
+# backend/core/boxes.py
+#
+# Vectorized helpers for (N, 4) arrays of x1, y1, x2, y2 boxes.
+
+import re
+
+import numpy as np
+
+
+def as_boxes(boxes):
+    """Returns boxes as a float (N, 4) array; None and empty inputs give a (0, 4) array."""
+    if boxes is None:
+        return np.empty((0, 4), dtype=float)
+    return np.asarray(boxes, dtype=float).reshape(-1, 4)
+
+
+def box_areas(boxes):
+    boxes = as_boxes(boxes)
+    return np.clip(boxes[:, 2] - boxes[:, 0], 0, None) * np.clip(boxes[:, 3] - boxes[:, 1], 0, None)
+
+
+def iou(a, b):
+    xa1, ya1, xa2, ya2 = a
+    xb1, yb1, xb2, yb2 = b
+    inter_w = max(0, min(xa2, xb2) - max(xa1, xb1))
+    inter_h = max(0, min(ya2, yb2) - max(ya1, yb1))
+    inter = inter_w * inter_h
+    if inter == 0:
+        return 0.0
+    area_a = (xa2 - xa1) * (ya2 - ya1)
+    area_b = (xb2 - xb1) * (yb2 - yb1)
+    return inter / float(area_a + area_b - inter)
+
+
+def pairwise_iou(a, b=None):
+    """IoU matrix of shape (len(a), len(b)); b defaults to a."""
+    a = as_boxes(a)
+    b = a if b is None else as_boxes(b)
+    x1 = np.maximum(a[:, None, 0], b[None, :, 0])
+    y1 = np.maximum(a[:, None, 1], b[None, :, 1])
+    x2 = np.minimum(a[:, None, 2], b[None, :, 2])
+    y2 = np.minimum(a[:, None, 3], b[None, :, 3])
+    inter = np.clip(x2 - x1, 0, None) * np.clip(y2 - y1, 0, None)
+    union = box_areas(a)[:, None] + box_areas(b)[None, :] - inter
+    with np.errstate(divide="ignore", invalid="ignore"):
+        return np.where(inter > 0, inter / union, 0.0)
+
+
+def overlapping_pairs(boxes, iou_thresh):
+    """Index pairs (i, j), i != j, of boxes whose IoU is above iou_thresh.
+
+    Sweep over x: after sorting by x1, box i can only overlap the boxes that
+    start before it ends, so only those candidate pairs get an IoU computed.
+    This keeps dense-but-local scenes (hundreds of OCR lines) far below n^2.
+    """
+    boxes = as_boxes(boxes)
+    order = np.argsort(boxes[:, 0], kind="stable")
+    b = boxes[order]
+    n = len(b)
+    ends = np.searchsorted(b[:, 0], b[:, 2], side="left")
+    counts = np.maximum(ends - np.arange(n) - 1, 0)
+    if counts.sum() == 0:
+        return np.empty(0, dtype=int), np.empty(0, dtype=int)
+    i = np.repeat(np.arange(n), counts)
+    offsets = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+    j = i + offsets + 1
+    bi, bj = b[i], b[j]
+    inter = (np.clip(np.minimum(bi[:, 2], bj[:, 2]) - np.maximum(bi[:, 0], bj[:, 0]), 0, None) *
+             np.clip(np.minimum(bi[:, 3], bj[:, 3]) - np.maximum(bi[:, 1], bj[:, 1]), 0, None))
+    area = box_areas(b)
+    union = area[i] + area[j] - inter
+    with np.errstate(divide="ignore", invalid="ignore"):
+        keep = (inter > 0) & (inter / union > iou_thresh)
+    return order[i[keep]], order[j[keep]]
+
+
+def _find(parent, i):
+    while parent[i] != i:
+        parent[i] = parent[parent[i]]
+        i = parent[i]
+    return i
+
+
+def merge_overlaps(boxes, iou_thresh=0.2, return_groups=False):
+    """Replaces every group of overlapping boxes with its bounding box.
+
+    Two boxes are linked when their IoU is above iou_thresh, and groups are the
+    connected components of those links (union-find), so chains of overlapping
+    boxes collapse into one. Output order follows the first box of each group.
+    With return_groups, also returns the index of the merged box each input
+    box went into.
+    """
+    boxes = np.asarray(boxes).reshape(-1, 4)
+    n = len(boxes)
+    if n < 2:
+        return (boxes.astype(int), np.arange(n)) if return_groups else boxes.astype(int)
+    ii, jj = overlapping_pairs(boxes, iou_thresh)
+    parent = list(range(n))
+    for i, j in zip(ii.tolist(), jj.tolist()):
+        ri, rj = _find(parent, i), _find(parent, j)
+        if ri != rj:
+            parent[max(ri, rj)] = min(ri, rj)
+    roots = np.array([_find(parent, i) for i in range(n)])
+    # Roots are the smallest index in each group, so unique() keeps the input order
+    _, first, inverse = np.unique(roots, return_index=True, return_inverse=True)
+    merged = boxes[first].copy()
+    np.minimum.at(merged[:, 0], inverse, boxes[:, 0])
+    np.minimum.at(merged[:, 1], inverse, boxes[:, 1])
+    np.maximum.at(merged[:, 2], inverse, boxes[:, 2])
+    np.maximum.at(merged[:, 3], inverse, boxes[:, 3])
+    return (merged.astype(int), inverse) if return_groups else merged.astype(int)
+
+
+def check_tiling(tile_size, overlap):
+    """Validates a tiling and returns its stride in pixels."""
+    if not 0 <= overlap < 1:
+        raise ValueError(f"Tile overlap must be in [0, 1), got {overlap}")
+    stride = int(tile_size * (1 - overlap))
+    if stride < 1:
+        raise ValueError(f"Tile overlap {overlap} leaves a stride under one pixel for {tile_size}-pixel tiles")
+    return stride
+
+
+def tile_grid(width, height, tile_size, overlap=0.2):
+    """Overlapping (x1, y1, x2, y2) tiles covering a width x height image.
+
+    Neighbouring tiles share about overlap * tile_size pixels, and the last
+    tile on each axis is aligned to the image edge rather than sticking out.
+    Raises ValueError unless 0 <= overlap < 1 and tiles advance by at least
+    one pixel.
+    """
+    stride = check_tiling(tile_size, overlap)
+
+    def starts(size):
+        if size <= tile_size:
+            return [0]
+        pos = list(range(0, size - tile_size, stride))
+        return pos + [size - tile_size]
+    return [(x, y, min(width, x + tile_size), min(height, y + tile_size))
+            for y in starts(height) for x in starts(width)]
+
+
+def clip_boxes(boxes, img_shape):
+    """Rounds boxes to ints and clips them to an image of img_shape; degenerate boxes are dropped."""
+    H, W = img_shape[:2]
+    boxes = np.rint(as_boxes(boxes)).astype(int)
+    boxes[:, [0, 2]] = boxes[:, [0, 2]].clip(0, W)
+    boxes[:, [1, 3]] = boxes[:, [1, 3]].clip(0, H)
+    keep = (boxes[:, 2] > boxes[:, 0]) & (boxes[:, 3] > boxes[:, 1])
+    return boxes[keep]
+
+
+def polygons_to_boxes(polygons):
+    """Axis-aligned bounding boxes of a list of point lists, e.g. OCR quadrilaterals."""
+    if len(polygons) == 0:
+        return np.empty((0, 4), dtype=float)
+    sizes = {len(p) for p in polygons}
+    if len(sizes) == 1:
+        pts = np.asarray(polygons, dtype=float)  # (N, K, 2)
+        return np.concatenate([pts.min(axis=1), pts.max(axis=1)], axis=1)
+    return np.array([np.r_[np.min(p, axis=0), np.max(p, axis=0)] for p in map(np.asarray, polygons)], dtype=float)
+
+
+def label_keep_mask(labels, keywords):
+    """Boolean mask of the labels that contain any of the keywords (case-insensitive)."""
+    if len(labels) == 0:
+        return np.zeros(0, dtype=bool)
+    pattern = re.compile("|".join(re.escape(k.lower()) for k in keywords))
+    return np.fromiter((pattern.search(lab.lower()) is not None for lab in labels), dtype=bool, count=len(labels))
+
+
+def union_masks(img_shape, list_of_boxes_lists, value=1):
+    """Rasterizes every box from every list into one uint8 mask set to value inside the boxes.
+
+    All lists are concatenated and clipped in one go before painting.
+    """
+    H, W = img_shape[:2]
+    boxes = [as_boxes(b) for b in list_of_boxes_lists if b is not None]
+    boxes = clip_boxes(np.concatenate(boxes) if boxes else as_boxes(None), (H, W))
+    mask = np.zeros((H, W), dtype=np.uint8)
+    # Painting slices is already a C-level fill per box; at the box counts we see it
+    # beats a summed-area table (see benchmarks/bench_boxes.py).
+    for x1, y1, x2, y2 in boxes.tolist():
+        mask[y1:y2, x1:x2] = value
+    return mask
@@ -0,0 +1,76 @@
+# backend/core/cache.py
+
+import hashlib
+import json
+import time
+from collections import OrderedDict
+
+
+def detection_key(image_bytes, categories):
+    """Content-addressed key for one image + set of redaction categories."""
+    h = hashlib.sha256(image_bytes)
+    h.update(json.dumps(sorted(set(categories))).encode("utf-8"))
+    return h.hexdigest()
+
+
+class DetectionCache:
+    """LRU cache with a per-entry TTL and a cap on the total stored bytes.
+
+    Callers pass the size of each value to put(); the least recently used
+    entries are evicted until both max_entries and max_bytes hold. Not
+    thread-safe; the server only touches it from the event loop.
+    """
+
+    def __init__(self, max_entries=256, max_bytes=256 * 1024 * 1024, ttl_seconds=600.0):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl_seconds = ttl_seconds
+        self._entries = OrderedDict()  # key -> (expires_at, nbytes, value)
+        self._bytes = 0
+        self._hits = 0
+        self._misses = 0
+        self._evictions = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, key):
+        entry = self._entries.get(key)
+        if entry is None:
+            self._misses += 1
+            return None
+        expires_at, _, value = entry
+        if expires_at < time.monotonic():
+            self._drop(key)
+            self._misses += 1
+            return None
+        self._entries.move_to_end(key)
+        self._hits += 1
+        return value
+
+    def put(self, key, value, nbytes):
+        if key in self._entries:
+            self._drop(key)
+        if nbytes > self.max_bytes or self.max_entries <= 0:
+            return
+        self._entries[key] = (time.monotonic() + self.ttl_seconds, nbytes, value)
+        self._bytes += nbytes
+        while len(self._entries) > self.max_entries or self._bytes > self.max_bytes:
+            self._drop(next(iter(self._entries)))
+            self._evictions += 1
+
+    def _drop(self, key):
+        _, nbytes, _ = self._entries.pop(key)
+        self._bytes -= nbytes
+
+    def metrics(self):
+        return {
+            "entries": len(self._entries),
+            "bytes": self._bytes,
+            "max_entries": self.max_entries,
+            "max_bytes": self.max_bytes,
+            "ttl_seconds": self.ttl_seconds,
+            "hits": self._hits,
+            "misses": self._misses,
+            "evictions": self._evictions,
+        }
@@ -0,0 +1,168 @@
+# backend/core/cascade.py
+#
+# Cheap CPU detectors that run ahead of Grounding DINO and OCR: a face detector
+# built on what OpenCV ships, and morphological text-region proposals that let
+# OCR look at a few crops instead of the whole image.
+
+import logging
+import os
+import threading
+
+import cv2
+import numpy as np
+
+from core.boxes import box_areas, clip_boxes, merge_overlaps
+from core.imaging import resize_for_detection, rescale_boxes
+
+log = logging.getLogger(__name__)
+
+# Frontal faces only by default: the profile cascade also has to run mirrored and
+# costs about five times as much for the faces it adds
+HAAR_CASCADES = ("haarcascade_frontalface_default.xml",)
+
+
+def _grow(boxes, pad, shape):
+    # Grows each box by pad times its size on every side, so hair, ears and chins are covered too
+    if len(boxes) == 0:
+        return boxes
+    w = boxes[:, 2] - boxes[:, 0]
+    h = boxes[:, 3] - boxes[:, 1]
+    dx, dy = (w * pad).astype(int), (h * pad).astype(int)
+    grown = np.stack([boxes[:, 0] - dx, boxes[:, 1] - dy, boxes[:, 2] + dx, boxes[:, 3] + dy], axis=1)
+    return clip_boxes(grown, shape[:2])
+
+
+class HaarFaceDetector:
+    """OpenCV's Haar cascades on a grayscale copy whose longer side is at most max_side.
+
+    Pass "haarcascade_profileface.xml" in cascades to also catch faces in
+    profile; profile cascades run on the mirrored image too, since they only
+    find faces turned one way. CascadeClassifier cannot be shared between
+    threads, so each thread loads its own.
+    """
+
+    def __init__(self, cascades=HAAR_CASCADES, max_side=640, scale_factor=1.15, min_neighbors=5, min_size=24,
+                 pad=0.2):
+        data_dir = getattr(getattr(cv2, "data", None), "haarcascades", "")
+        self.paths = [c if os.path.isfile(c) else os.path.join(data_dir, c) for c in cascades]
+        for path in self.paths:
+            if not os.path.isfile(path) or cv2.CascadeClassifier(path).empty():
+                raise FileNotFoundError(f"Haar cascade not found: {path}")
+        self.max_side = max_side
+        self.scale_factor = scale_factor
+        self.min_neighbors = min_neighbors
+        self.min_size = min_size
+        self.pad = pad
+        self._local = threading.local()
+
+    def _classifiers(self):
+        classifiers = getattr(self._local, "classifiers", None)
+        if classifiers is None:
+            classifiers = self._local.classifiers = [
+                (cv2.CascadeClassifier(p), "profile" in os.path.basename(p)) for p in self.paths]
+        return classifiers
+
+    def __call__(self, img_bgr):
+        small = resize_for_detection(img_bgr, self.max_side)
+        gray = cv2.equalizeHist(cv2.cvtColor(small, cv2.COLOR_BGR2GRAY))
+        width = gray.shape[1]
+        rects = []
+        for classifier, mirrored in self._classifiers():
+            for flip in (False, True) if mirrored else (False,):
+                found = classifier.detectMultiScale(cv2.flip(gray, 1) if flip else gray, self.scale_factor,
+                                                    self.min_neighbors, minSize=(self.min_size, self.min_size))
+                for x, y, w, h in found:
+                    rects.append((width - x - w if flip else x, y, w, h))
+        if not rects:
+            return np.empty((0, 4), dtype=int)
+        rects = np.asarray(rects, dtype=int)
+        boxes = np.stack([rects[:, 0], rects[:, 1], rects[:, 0] + rects[:, 2], rects[:, 1] + rects[:, 3]], axis=1)
+        boxes = merge_overlaps(_grow(boxes, self.pad, small.shape), iou_thresh=0.1)
+        return rescale_boxes(boxes, small.shape, img_bgr.shape)
+
+
+class YuNetFaceDetector:
+    """OpenCV's YuNet face detector (cv2.FaceDetectorYN), for a local ONNX model file.
+
+    More accurate than the Haar cascades, and the only face detector left in
+    OpenCV 5, which no longer ships CascadeClassifier.
+    """
+
+    def __init__(self, model_path, max_side=640, score_threshold=0.6, pad=0.2):
+        if not os.path.isfile(model_path):
+            raise FileNotFoundError(f"YuNet model not found: {model_path}")
+        self.model_path = model_path
+        self.max_side = max_side
+        self.score_threshold = score_threshold
+        self.pad = pad
+        self._local = threading.local()
+        # Load it once here so a bad model file fails now rather than on the first request
+        self._local.detector = cv2.FaceDetectorYN.create(model_path, "", (max_side, max_side), score_threshold)
+
+    def __call__(self, img_bgr):
+        small = resize_for_detection(img_bgr, self.max_side)
+        h, w = small.shape[:2]
+        detector = getattr(self._local, "detector", None)
+        if detector is None:
+            detector = self._local.detector = cv2.FaceDetectorYN.create(self.model_path, "", (w, h),
+                                                                        self.score_threshold)
+        detector.setInputSize((w, h))
+        _, faces = detector.detect(small)
+        if faces is None or len(faces) == 0:
+            return np.empty((0, 4), dtype=int)
+        x, y, fw, fh = (faces[:, i] for i in range(4))
+        boxes = np.stack([x, y, x + fw, y + fh], axis=1).astype(int)
+        return rescale_boxes(_grow(boxes, self.pad, small.shape), small.shape, img_bgr.shape)
+
+
+def load_face_detector(model_path=None):
+    """YuNet when model_path is an ONNX file, otherwise the Haar cascades; None if those are unavailable.
+
+    A model_path that cannot be loaded raises instead, since it was asked
+    for explicitly.
+    """
+    if model_path:
+        return YuNetFaceDetector(model_path)
+    try:
+        if not hasattr(cv2, "CascadeClassifier"):
+            raise RuntimeError(f"OpenCV {cv2.__version__} has no CascadeClassifier")
+        return HaarFaceDetector()
+    except Exception as e:
+        log.warning("Haar face detector not available (%s); install opencv-python<5 or set FACE_MODEL "
+                    "to a YuNet ONNX model.", e)
+        return None
+
+
+def text_regions(img_bgr, max_side=1024, min_height=6, max_cover=0.5, max_regions=16, pad=0.15):
+    """Boxes that look like lines of text, for running OCR on crops instead of the whole image.
+
+    Edges from the morphological gradient are split into connected
+    components; character-sized ones are kept and joined horizontally into
+    lines, so long edges and large textured areas drop out. Returns boxes in
+    img_bgr coordinates, or None when there are more than max_regions lines
+    or they cover more than max_cover of the image, because OCR on the whole
+    image is then cheaper than on the crops.
+    """
+    small = resize_for_detection(img_bgr, max_side)
+    gray = cv2.cvtColor(small, cv2.COLOR_BGR2GRAY)
+    grad = cv2.morphologyEx(gray, cv2.MORPH_GRADIENT, cv2.getStructuringElement(cv2.MORPH_ELLIPSE, (3, 3)))
+    _, edges = cv2.threshold(grad, 0, 255, cv2.THRESH_BINARY | cv2.THRESH_OTSU)
+    n, labels, stats, _ = cv2.connectedComponentsWithStats(edges, connectivity=8)
+    _, _, w, h, area = stats[1:].T
+    is_char = ((h >= min_height) & (h <= 0.15 * small.shape[0]) & (w <= 4 * h)
+               & (area >= 0.15 * w * h) & (area <= 0.9 * w * h))
+    keep = np.zeros(n, dtype=np.uint8)
+    keep[1:][is_char] = 255
+    lines = cv2.dilate(keep[labels], cv2.getStructuringElement(cv2.MORPH_RECT, (15, 3)))
+    contours, _ = cv2.findContours(lines, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+    boxes = []
+    for contour in contours:
+        x, y, bw, bh = cv2.boundingRect(contour)
+        if bw >= 2 * bh:  # a line has at least a couple of characters side by side
+            boxes.append((x, y, x + bw, y + bh))
+    if not boxes:
+        return np.empty((0, 4), dtype=int)
+    boxes = merge_overlaps(_grow(np.asarray(boxes, dtype=int), pad, small.shape), iou_thresh=0.0)
+    if len(boxes) > max_regions or box_areas(boxes).sum() > max_cover * small.shape[0] * small.shape[1]:
+        return None
+    return rescale_boxes(boxes, small.shape, img_bgr.shape)
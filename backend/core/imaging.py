@@ -0,0 +1,97 @@
+# backend/core/imaging.py
+#
+# The OpenCV/NumPy stages of the pipeline. Nothing here needs torch or the
+# models, so these can be used (and benchmarked) on any machine.
+
+import numpy as np
+import cv2
+
+from core.boxes import box_areas, merge_overlaps
+
+# Past this fraction of the frame, one full-frame blur is cheaper than blurring the regions
+FULL_FRAME_BLUR_FRACTION = 0.5
+
+
+def resize_for_detection(img_bgr, max_side):
+    """Downscales img_bgr so its longer side is at most max_side (0 disables); never upscales."""
+    h, w = img_bgr.shape[:2]
+    if max_side <= 0 or max(h, w) <= max_side:
+        return img_bgr
+    scale = max_side / float(max(h, w))
+    size = (max(1, round(w * scale)), max(1, round(h * scale)))
+    return cv2.resize(img_bgr, size, interpolation=cv2.INTER_AREA)
+
+def rescale_boxes(boxes, from_shape, to_shape):
+    """Maps boxes detected on an image of from_shape onto an image of to_shape, clipped to its bounds."""
+    boxes = np.asarray(boxes, dtype=float).reshape(-1, 4)
+    fh, fw = from_shape[:2]
+    th, tw = to_shape[:2]
+    sx, sy = tw / float(fw), th / float(fh)
+    out = boxes * np.array([sx, sy, sx, sy])
+    # Round outwards so a scaled box never shrinks away from the object edges
+    out[:, :2] = np.floor(out[:, :2])
+    out[:, 2:] = np.ceil(out[:, 2:])
+    out[:, [0, 2]] = out[:, [0, 2]].clip(0, tw)
+    out[:, [1, 3]] = out[:, [1, 3]].clip(0, th)
+    return out.astype(int)
+
+def mask_regions(mask, pad=0):
+    """Bounding boxes (x1, y1, x2, y2) of the connected regions of a mask, grown by pad and clipped to the image."""
+    H, W = mask.shape[:2]
+    n, _, stats, _ = cv2.connectedComponentsWithStats((mask > 0).astype(np.uint8), connectivity=8)
+    regions = []
+    for x, y, w, h, _ in stats[1:]:
+        regions.append((max(0, x - pad), max(0, y - pad), min(W, x + w + pad), min(H, y + h + pad)))
+    return regions
+
+def blur_regions(mask, pad):
+    """mask_regions() grown by pad, with overlapping regions merged until none overlap.
+
+    Every nonzero mask pixel then has its whole pad-radius neighbourhood
+    inside exactly one region, so each pixel is blurred once.
+    """
+    regions = np.asarray(mask_regions(mask, pad), dtype=int).reshape(-1, 4)
+    while len(regions) > 1:
+        merged = merge_overlaps(regions, iou_thresh=0.0)
+        if len(merged) == len(regions):
+            break
+        regions = merged
+    return regions
+
+def redact(img_bgr, mask, method="blur", blur_ksize=151, mosaic_scale=0.06, out=None):
+    """Blurs or pixelates the nonzero pixels of mask.
+
+    Works one merged region at a time, so only the padded area around the
+    detections is filtered instead of the whole frame, unless that area is
+    most of the frame anyway. The result is written into
+    out when given (e.g. a buffer reused across calls), otherwise into a copy.
+    """
+    if out is None:
+        out = img_bgr.copy()
+    else:
+        np.copyto(out, img_bgr)
+    if not mask.any():
+        return out
+    H, W = img_bgr.shape[:2]
+    if method == "pixelate":
+        for x1, y1, x2, y2 in mask_regions(mask):
+            roi = img_bgr[y1:y2, x1:x2]
+            h, w = roi.shape[:2]
+            small = cv2.resize(roi, (max(1, int(w * mosaic_scale)), max(1, int(h * mosaic_scale))), interpolation=cv2.INTER_LINEAR)
+            pix = cv2.resize(small, (w, h), interpolation=cv2.INTER_NEAREST)
+            roi_mask = mask[y1:y2, x1:x2] > 0
+            out[y1:y2, x1:x2][roi_mask] = pix[roi_mask]
+    else:  # blur
+        if blur_ksize % 2 == 0:
+            blur_ksize += 1
+        # Each masked pixel's kernel window lies inside its one merged region (or is cut
+        # off by the image border, as in a full-frame blur), so the result matches a
+        # full-frame blur exactly
+        regions = blur_regions(mask, pad=blur_ksize // 2)
+        if box_areas(regions).sum() >= FULL_FRAME_BLUR_FRACTION * H * W:
+            regions = [(0, 0, W, H)]
+        for x1, y1, x2, y2 in regions:
+            blurred = cv2.GaussianBlur(img_bgr[y1:y2, x1:x2], (blur_ksize, blur_ksize), 0)
+            roi_mask = mask[y1:y2, x1:x2] > 0
+            out[y1:y2, x1:x2][roi_mask] = blurred[roi_mask]
+    return out
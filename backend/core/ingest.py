@@ -0,0 +1,176 @@
+# backend/core/ingest.py
+#
+# Getting images in: bounded upload reads and URL fetches, a header-only size
+# check before any pixels are decoded, and an EXIF-aware OpenCV decode.
+
+import io
+import time
+
+import cv2
+import numpy as np
+import requests
+from PIL import Image
+from requests.adapters import HTTPAdapter
+
+from core.imaging import resize_for_detection
+
+MAX_IMAGE_BYTES = 40 * 1024 * 1024
+MAX_IMAGE_PIXELS = 100_000_000
+FETCH_TIMEOUT = 15.0  # seconds, for the whole download
+
+EXIF_ORIENTATION = 0x0112
+
+# cv2 can decode JPEGs at 1/2, 1/4 or 1/8 scale for a fraction of the cost of a full decode
+REDUCED_DECODE_FLAGS = [(8, cv2.IMREAD_REDUCED_COLOR_8), (4, cv2.IMREAD_REDUCED_COLOR_4),
+                        (2, cv2.IMREAD_REDUCED_COLOR_2)]
+
+
+class ImageRejected(ValueError):
+    """Raised when an input is refused before decoding because it has too many bytes or pixels."""
+
+
+def probe(image_bytes):
+    """Returns (width, height, orientation) from the image header, or None if PIL cannot parse it.
+
+    width and height are as displayed, i.e. already swapped for EXIF
+    orientations that rotate by 90 degrees. Nothing is decoded.
+    """
+    try:
+        with Image.open(io.BytesIO(image_bytes)) as img:
+            width, height = img.size
+            orientation = img.getexif().get(EXIF_ORIENTATION, 1)
+    except Image.DecompressionBombError as e:
+        raise ImageRejected(str(e))
+    except Exception:
+        return None
+    if orientation not in range(1, 9):
+        orientation = 1
+    if orientation >= 5:
+        width, height = height, width
+    return width, height, orientation
+
+
+def check_pixels(width, height, max_pixels=MAX_IMAGE_PIXELS):
+    if max_pixels and width * height > max_pixels:
+        raise ImageRejected(f"Image is {width}x{height}; at most {max_pixels} pixels are accepted.")
+
+
+def orient(img, orientation):
+    """Applies an EXIF orientation (1-8) to a decoded array so it is upright."""
+    if orientation == 2:
+        return cv2.flip(img, 1)
+    if orientation == 3:
+        return cv2.rotate(img, cv2.ROTATE_180)
+    if orientation == 4:
+        return cv2.flip(img, 0)
+    if orientation == 5:
+        return cv2.transpose(img)
+    if orientation == 6:
+        return cv2.rotate(img, cv2.ROTATE_90_CLOCKWISE)
+    if orientation == 7:
+        return cv2.flip(cv2.transpose(img), -1)
+    if orientation == 8:
+        return cv2.rotate(img, cv2.ROTATE_90_COUNTERCLOCKWISE)
+    return img
+
+
+def decode(image_bytes, flag=cv2.IMREAD_COLOR, orientation=1):
+    # Orientation is applied here rather than by OpenCV, whose handling depends on
+    # the version and format, so every caller gets the same upright pixels
+    img_bgr = cv2.imdecode(np.frombuffer(image_bytes, np.uint8), flag | cv2.IMREAD_IGNORE_ORIENTATION)
+    if img_bgr is None:
+        raise ValueError("Error loading image: Could not decode image from input.")
+    return orient(img_bgr, orientation)
+
+
+def load_image(image_bytes, max_pixels=MAX_IMAGE_PIXELS):
+    """Full-resolution, upright BGR decode, refusing images over max_pixels before decoding."""
+    header = probe(image_bytes)
+    if header is None:
+        img_bgr = decode(image_bytes)
+        check_pixels(img_bgr.shape[1], img_bgr.shape[0], max_pixels)
+        return img_bgr
+    width, height, orientation = header
+    check_pixels(width, height, max_pixels)
+    return decode(image_bytes, orientation=orientation)
+
+
+def load_image_for_detection(image_bytes, max_side, max_pixels=MAX_IMAGE_PIXELS):
+    """Decodes a copy whose longer side is at most max_side, for the detectors.
+
+    Uses the largest reduced-decode factor that still keeps at least max_side
+    pixels, then resizes the rest of the way. Returns (img_bgr, is_full_res);
+    when is_full_res is True the copy is the whole image and the caller does
+    not need to decode again for redaction.
+    """
+    header = probe(image_bytes)
+    if header is None:
+        img_bgr = load_image(image_bytes, max_pixels)
+        img_det = resize_for_detection(img_bgr, max_side)
+        return img_det, img_det is img_bgr
+    width, height, orientation = header
+    check_pixels(width, height, max_pixels)
+    if max_side <= 0 or max(width, height) <= max_side:
+        return decode(image_bytes, orientation=orientation), True
+    flag = cv2.IMREAD_COLOR
+    for factor, reduced_flag in REDUCED_DECODE_FLAGS:
+        if max(width, height) // factor >= max_side:
+            flag = reduced_flag
+            break
+    return resize_for_detection(decode(image_bytes, flag, orientation), max_side), False
+
+
+def to_pil(img_bgr):
+    """RGB PIL copy of a BGR array; the channels are swapped during the copy instead of
+    through a full-size cvtColor temporary."""
+    img_bgr = np.ascontiguousarray(img_bgr)
+    h, w = img_bgr.shape[:2]
+    return Image.frombuffer("RGB", (w, h), img_bgr, "raw", "BGR", 0, 1)
+
+
+def _append_bounded(buf, chunk, max_bytes):
+    buf += chunk
+    if max_bytes and len(buf) > max_bytes:
+        raise ImageRejected(f"Image is larger than {max_bytes} bytes.")
+
+
+async def read_upload(upload, max_bytes=MAX_IMAGE_BYTES, chunk_size=1 << 20):
+    """Reads a FastAPI UploadFile in chunks, giving up as soon as it passes max_bytes."""
+    buf = bytearray()
+    while True:
+        chunk = await upload.read(chunk_size)
+        if not chunk:
+            return bytes(buf)
+        _append_bounded(buf, chunk, max_bytes)
+
+
+_session = None
+
+
+def http_session(pool_size=16):
+    # One keep-alive connection pool for every fetch in the process
+    global _session
+    if _session is None:
+        session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+        session.mount("http://", adapter)
+        session.mount("https://", adapter)
+        _session = session
+    return _session
+
+
+def fetch_url(url, max_bytes=MAX_IMAGE_BYTES, timeout=FETCH_TIMEOUT, chunk_size=64 * 1024):
+    """Downloads url into memory, bounded by max_bytes and timeout seconds overall."""
+    deadline = time.monotonic() + timeout
+    with http_session().get(url, stream=True, timeout=timeout) as resp:
+        resp.raise_for_status()
+        length = resp.headers.get("Content-Length")
+        if max_bytes and length and length.isdigit() and int(length) > max_bytes:
+            raise ImageRejected(f"Image is {length} bytes; at most {max_bytes} are accepted.")
+        buf = bytearray()
+        for chunk in resp.iter_content(chunk_size):
+            _append_bounded(buf, chunk, max_bytes)
+            if time.monotonic() > deadline:
+                raise TimeoutError(f"Fetching {url} took longer than {timeout}s")
+    return bytes(buf)
+
@@ -0,0 +1,194 @@
+# backend/core/jobs.py
+
+import asyncio
+import time
+import uuid
+from collections import OrderedDict
+
+
+class IdempotencyConflict(Exception):
+    """An idempotency key was reused for a different request."""
+
+
+class Job:
+    """One submitted job: its status, which stages have finished, and the result or error.
+
+    status goes queued -> running -> done or failed. Every update bumps
+    version, so pollers and event streams can tell whether anything changed
+    since they last looked.
+    """
+
+    def __init__(self, key=None, fingerprint=None):
+        self.id = uuid.uuid4().hex
+        self.key = key
+        self.fingerprint = fingerprint
+        self.status = "queued"
+        self.stages_done = []
+        self.stages_pending = []
+        self.result = None
+        self.error = None
+        self.version = 0
+        self.created_at = time.time()
+        self.task = None
+        self.expires_at = None  # monotonic; set when the job finishes
+        self._changed = asyncio.Event()
+
+    @property
+    def finished(self):
+        return self.status in ("done", "failed")
+
+    def progress(self, stage, pending=()):
+        """Records that stage has finished; pending names the stages still to come."""
+        self.stages_done.append(stage)
+        self.stages_pending = list(pending)
+        self._update()
+
+    def _update(self):
+        # Each update sets the current event and swaps in a fresh one, waking every waiter once
+        self.version += 1
+        self._changed.set()
+        self._changed = asyncio.Event()
+
+    async def wait(self, version, timeout=None):
+        """Waits until the job is past version; False if timeout passes first."""
+        if self.version > version:
+            return True
+        try:
+            await asyncio.wait_for(self._changed.wait(), timeout)
+            return True
+        except asyncio.TimeoutError:
+            return False
+
+    def snapshot(self):
+        done, pending = len(self.stages_done), len(self.stages_pending)
+        if self.status == "done":
+            fraction = 1.0
+        else:
+            fraction = done / (done + pending) if done + pending else 0.0
+        return {
+            "job_id": self.id,
+            "status": self.status,
+            "stage": self.stages_done[-1] if self.stages_done else None,
+            "stages_done": list(self.stages_done),
+            "stages_pending": list(self.stages_pending),
+            "progress": round(fraction, 3),
+            "version": self.version,
+            "created_at": self.created_at,
+        }
+
+
+class JobStore:
+    """In-process registry of running and recently finished jobs.
+
+    submit() starts ``run(job)`` as a task and returns the Job straight away;
+    whatever run returns becomes job.result, and an exception becomes
+    job.error. Finished jobs are kept for ttl_seconds so clients can still
+    fetch the result, and only the newest max_jobs of them are kept.
+
+    A submit() whose idempotency key belongs to a job still in the store
+    returns that job instead of starting another one, so a client retrying
+    after a dropped connection does not run the work twice. A failed job
+    gives its key up, so retrying after a failure runs again. Not
+    thread-safe; the server only touches it from the event loop.
+    """
+
+    def __init__(self, max_jobs=64, ttl_seconds=300.0):
+        self.max_jobs = max_jobs
+        self.ttl_seconds = ttl_seconds
+        self._jobs = OrderedDict()  # job id -> Job, oldest first
+        self._keys = {}  # idempotency key -> job id
+        self._submitted = 0
+        self._deduplicated = 0
+        self._failed = 0
+        self._expired = 0
+
+    def __len__(self):
+        return len(self._jobs)
+
+    def get(self, job_id):
+        self._expire()
+        return self._jobs.get(job_id)
+
+    def find(self, key, fingerprint=None):
+        """The job holding idempotency key, or None.
+
+        Raises IdempotencyConflict if that job was submitted with a different
+        fingerprint, i.e. the key was reused for another request.
+        """
+        if key is None:
+            return None
+        self._expire()
+        job = self._jobs.get(self._keys.get(key))
+        if job is None:
+            return None
+        if job.fingerprint != fingerprint:
+            raise IdempotencyConflict(f"Idempotency key {key!r} was already used for a different request")
+        self._deduplicated += 1
+        return job
+
+    def submit(self, run, key=None, fingerprint=None):
+        """Starts run(job) unless key already has a job; returns (job, created)."""
+        job = self.find(key, fingerprint)
+        if job is not None:
+            return job, False
+        job = Job(key, fingerprint)
+        self._jobs[job.id] = job
+        if key is not None:
+            self._keys[key] = job.id
+        self._submitted += 1
+        job.task = asyncio.get_running_loop().create_task(self._run(job, run))
+        self._evict()
+        return job, True
+
+    async def _run(self, job, run):
+        job.status = "running"
+        job._update()
+        try:
+            job.result = await run(job)
+            job.status = "done"
+        except Exception as e:
+            job.error = e
+            job.status = "failed"
+            self._failed += 1
+            if job.key is not None and self._keys.get(job.key) == job.id:
+                del self._keys[job.key]
+        finally:
+            job.expires_at = time.monotonic() + self.ttl_seconds
+            job._update()
+
+    def _expire(self):
+        now = time.monotonic()
+        for job in [j for j in self._jobs.values() if j.expires_at is not None and j.expires_at < now]:
+            self._drop(job)
+            self._expired += 1
+
+    def _evict(self):
+        # Oldest finished jobs go first; running ones are never dropped, the
+        # inference pool's admission limit already bounds how many there are
+        excess = len(self._jobs) - self.max_jobs
+        for job in [j for j in self._jobs.values() if j.finished][:max(excess, 0)]:
+            self._drop(job)
+
+    def _drop(self, job):
+        del self._jobs[job.id]
+        if job.key is not None and self._keys.get(job.key) == job.id:
+            del self._keys[job.key]
+
+    async def aclose(self):
+        tasks = [job.task for job in self._jobs.values() if not job.finished]
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    def metrics(self):
+        jobs = list(self._jobs.values())
+        return {
+            "jobs": len(jobs),
+            "running": sum(not job.finished for job in jobs),
+            "max_jobs": self.max_jobs,
+            "ttl_seconds": self.ttl_seconds,
+            "submitted": self._submitted,
+            "deduplicated": self._deduplicated,
+            "failed": self._failed,
+            "expired": self._expired,
+        }
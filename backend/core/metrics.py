@@ -0,0 +1,192 @@
+# backend/core/metrics.py
+#
+# A small Prometheus-compatible metrics registry (text exposition format 0.0.4),
+# plus the queue-backed logging setup the server uses instead of print().
+
+import bisect
+import contextlib
+import logging
+import logging.handlers
+import os
+import queue
+import sys
+import threading
+import time
+
+# Seconds; covers everything from a mask paint to a cold CPU Grounding DINO pass
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+
+def _label_str(names, values):
+    if not names:
+        return ""
+    pairs = ",".join(f'{n}="{str(v)}"' for n, v in zip(names, values))
+    return "{" + pairs + "}"
+
+
+class _Metric:
+    kind = None
+
+    def __init__(self, name, help_text, label_names=()):
+        self.name = name
+        self.help = help_text
+        self.label_names = tuple(label_names)
+        self._lock = threading.Lock()
+        self._values = {}
+        self._fn = None
+
+    def _key(self, labels):
+        if set(labels) != set(self.label_names):
+            raise ValueError(f"{self.name} expects labels {self.label_names}, got {tuple(labels)}")
+        return tuple(labels[n] for n in self.label_names)
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+        lines.extend(self._samples())
+        return lines
+
+    def _samples(self):
+        # Callback metrics (fn set, no labels) are read at scrape time, for values
+        # another component already keeps count of
+        if self._fn is not None:
+            return [f"{self.name} {float(self._fn())}"]
+        with self._lock:
+            items = list(self._values.items())
+        return [f"{self.name}{_label_str(self.label_names, k)} {v}" for k, v in items]
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def __init__(self, name, help_text, label_names=(), fn=None):
+        super().__init__(name, help_text, label_names)
+        self._fn = fn
+
+    def inc(self, amount=1.0, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+
+class Gauge(_Metric):
+    kind = "gauge"
+
+    def __init__(self, name, help_text, label_names=(), fn=None):
+        super().__init__(name, help_text, label_names)
+        self._fn = fn
+
+    def set(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = float(value)
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name, help_text, label_names=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, help_text, label_names)
+        self.buckets = tuple(sorted(buckets))
+        self._series = {}  # key -> [bucket counts..., sum, count]
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        i = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.setdefault(key, [0] * len(self.buckets) + [0.0, 0])
+            if i < len(self.buckets):
+                series[i] += 1
+            series[-2] += value
+            series[-1] += 1
+
+    @contextlib.contextmanager
+    def time(self, **labels):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def _samples(self):
+        with self._lock:
+            items = [(k, list(v)) for k, v in self._series.items()]
+        lines = []
+        for key, series in items:
+            cumulative = 0
+            for bound, count in zip(self.buckets, series):
+                cumulative += count
+                labels = _label_str(self.label_names + ("le",), key + (repr(float(bound)),))
+                lines.append(f"{self.name}_bucket{labels} {cumulative}")
+            labels = _label_str(self.label_names + ("le",), key + ("+Inf",))
+            lines.append(f"{self.name}_bucket{labels} {series[-1]}")
+            lines.append(f"{self.name}_sum{_label_str(self.label_names, key)} {series[-2]}")
+            lines.append(f"{self.name}_count{_label_str(self.label_names, key)} {series[-1]}")
+        return lines
+
+
+class Registry:
+    def __init__(self):
+        self._metrics = []
+
+    def _add(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def counter(self, name, help_text, label_names=(), fn=None):
+        return self._add(Counter(name, help_text, label_names, fn))
+
+    def gauge(self, name, help_text, label_names=(), fn=None):
+        return self._add(Gauge(name, help_text, label_names, fn))
+
+    def histogram(self, name, help_text, label_names=(), buckets=DEFAULT_BUCKETS):
+        return self._add(Histogram(name, help_text, label_names, buckets))
+
+    def render(self):
+        lines = []
+        for metric in self._metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+_log_listener = None
+_fork_hook_registered = False
+
+
+def _restart_listener_after_fork():
+    # The listener thread does not survive fork(); give the child its own
+    global _log_listener
+    if _log_listener is not None:
+        _log_listener = logging.handlers.QueueListener(_log_listener.queue, *_log_listener.handlers,
+                                                       respect_handler_level=True)
+        _log_listener.start()
+
+
+def setup_logging(level="INFO"):
+    """Routes all logging through a queue drained by a background thread.
+
+    Request handlers only pay for a queue put; formatting and the write to
+    stderr happen on the listener thread. Safe to call more than once, and
+    forked children (serve.py) get a listener of their own.
+    """
+    global _log_listener, _fork_hook_registered
+    if _log_listener is not None:
+        return _log_listener
+    log_queue = queue.SimpleQueue()
+    stream = logging.StreamHandler(sys.stderr)
+    stream.setFormatter(logging.Formatter("%(asctime)s %(levelname)s %(process)d %(name)s: %(message)s"))
+    root = logging.getLogger()
+    root.handlers = [logging.handlers.QueueHandler(log_queue)]
+    root.setLevel(level.upper())
+    _log_listener = logging.handlers.QueueListener(log_queue, stream, respect_handler_level=True)
+    _log_listener.start()
+    if not _fork_hook_registered:
+        os.register_at_fork(after_in_child=_restart_listener_after_fork)
+        _fork_hook_registered = True
+    return _log_listener
+
+
+def stop_logging():
+    global _log_listener
+    if _log_listener is not None:
+        _log_listener.stop()
+        _log_listener = None
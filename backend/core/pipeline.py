@@ -0,0 +1,560 @@
+# backend/core/pipeline.py
+#
+# The redaction engine every entry point shares. RedactionPipeline owns the
+# models, the device, warmup and the detection settings, and exposes sync,
+# batch and async calls; server.py (FastAPI), backend_api.py (Flask) and the
+# process_image/process_video CLIs are thin adapters over it.
+
+import asyncio
+import contextlib
+import itertools
+import logging
+import threading
+import time
+
+import cv2
+import numpy as np
+import torch
+from PIL import Image
+
+from core import ingest
+from core.batching import MicroBatcher
+from core.cascade import load_face_detector, text_regions
+from core.boxes import check_tiling, tile_grid, union_masks
+from core.imaging import redact, resize_for_detection, rescale_boxes
+from core.prompts import PromptCache, prompt_text, install_text_feature_cache
+from core.redactor import (
+    load_gdino, load_geoclip, predict_geoclip, detect_gdino_batch, try_ocr, detect_ocr_boxes, filter_ocr_boxes,
+    tile_items, merge_tile_results,
+)
+
+log = logging.getLogger(__name__)
+
+# Grounding DINO prompts for each category the app can ask to redact
+CATEGORY_QUERIES = {
+    "flag": ["flag", "country flags", "state flags"],
+    "sign": ["street name sign", "road name sign"],
+    "faces": ["human faces", "faces", "people faces", "child faces", "human head", "people head"],
+    "landmark": ["famous landmark", "monument", "historical site", "tourist attraction"],
+}
+
+# Which detectors each category is routed to, cheapest first:
+#   faces        OpenCV face detector (core/cascade.py), tens of milliseconds on CPU
+#   gdino        Grounding DINO with the category's CATEGORY_QUERIES
+#   ocr          OCR over the whole detection copy
+#   ocr_regions  OCR only on crops that look like text (falls back to the whole image
+#                when those cover most of it)
+# A request runs the union of the routes of the categories it asks for, so Grounding
+# DINO and OCR are skipped entirely when none of its categories need them.
+ROUTE_STAGES = ("faces", "gdino", "ocr", "ocr_regions")
+DEFAULT_ROUTES = {
+    "faces": ("faces",),
+    "flag": ("gdino",),
+    "sign": ("gdino", "ocr"),
+    "landmark": ("gdino",),
+    "text": ("ocr",),
+}
+
+# What the CLIs and the Flask app look for when no categories are given
+DEFAULT_QUERIES = ["street name sign", "road name sign", "flag", "landmark", "monument", "person", "child"]
+
+# Output encodings: extension, media type and the OpenCV quality flag (None = lossless)
+IMAGE_FORMATS = {
+    "jpeg": (".jpg", "image/jpeg", cv2.IMWRITE_JPEG_QUALITY),
+    "webp": (".webp", "image/webp", cv2.IMWRITE_WEBP_QUALITY),
+    "png": (".png", "image/png", None),
+}
+
+
+def parse_routes(spec):
+    """DEFAULT_ROUTES with overrides from a "category=stage+stage,..." string.
+
+    e.g. "faces=gdino" sends faces back to Grounding DINO, and
+    "sign=gdino+ocr_regions" limits OCR to text-like regions for signs.
+    """
+    routes = dict(DEFAULT_ROUTES)
+    for item in filter(None, (part.strip() for part in (spec or "").split(","))):
+        category, _, stages = item.partition("=")
+        stages = tuple(s.strip() for s in stages.split("+") if s.strip())
+        unknown = [s for s in stages if s not in ROUTE_STAGES]
+        if not category.strip() or unknown:
+            raise ValueError(f"Bad route {item!r}: stages must be from {ROUTE_STAGES}")
+        routes[category.strip()] = stages
+    return routes
+
+
+def category_prompts(categories=None):
+    # Every prompt plan() can produce: one per non-empty set of the Grounding DINO categories
+    categories = [c for c in CATEGORY_QUERIES if categories is None or c in categories]
+    prompts = []
+    for n in range(1, len(categories) + 1):
+        for combo in itertools.combinations(categories, n):
+            prompts.append(prompt_text([q for c in combo for q in CATEGORY_QUERIES[c]]))
+    return prompts
+
+
+def no_boxes():
+    return np.empty((0, 4), dtype=int)
+
+
+# Stand-ins for the detectors a request does not need, so asyncio.gather keeps its shape
+async def _no_boxes():
+    return no_boxes()
+
+
+async def _no_gdino():
+    return no_boxes(), [], np.empty((0,))
+
+
+async def _no_location():
+    return None, None
+
+
+async def _gather_all(*aws):
+    # gather() that lets every call finish before raising the first error, so no
+    # model-worker call is still reading a shared-memory frame once its block exits
+    results = await asyncio.gather(*aws, return_exceptions=True)
+    for result in results:
+        if isinstance(result, BaseException):
+            raise result
+    return results
+
+
+class RedactionPipeline:
+    """Grounding DINO, GeoCLIP and OCR behind one object, loaded once and shared by every caller.
+
+    Detection runs on a copy whose longer side is at most detect_max_side
+    (0 = full resolution) and boxes are scaled back to the input. keep_labels
+    filters Grounding DINO labels by keyword (None keeps all of them);
+    ocr_min_area (in pixels of the input image, not the detection copy) and
+    ocr_merge drop small OCR boxes and merge overlapping ones. With
+    tile_size > 0, detection also runs on overlapping tiles.
+    routes maps each category to its detectors (see DEFAULT_ROUTES);
+    face_model is an optional YuNet ONNX file for the face stage.
+
+    The async calls need pool, a WorkerPool; concurrent Grounding DINO calls
+    are then grouped into batches of up to max_batch. stage_timer(stage),
+    if given, returns a context manager wrapped around each stage;
+    on_batch_wait(seconds) and on_load(model, seconds) report batch queueing
+    and model load times.
+    """
+
+    def __init__(self, device=None, backend="eager", onnx_path="gdino.onnx", box_threshold=0.25,
+                 text_threshold=0.20, keep_labels=None, detect_max_side=1333, max_pixels=ingest.MAX_IMAGE_PIXELS,
+                 tile_size=0, tile_overlap=0.2, max_batch=8, max_wait_ms=15.0, text_cache=True, use_geoclip=True,
+                 use_ocr=True, ocr_min_area=0, ocr_merge=False, routes=None, face_model=None, pool=None,
+                 stage_timer=None, on_batch_wait=None, on_load=None):
+        self.device = device or ("cuda" if torch.cuda.is_available() else "cpu")
+        self.backend = backend
+        self.onnx_path = onnx_path
+        self.box_threshold = box_threshold
+        self.text_threshold = text_threshold
+        self.keep_labels = keep_labels
+        self.detect_max_side = detect_max_side
+        self.max_pixels = max_pixels
+        if tile_size > 0:
+            check_tiling(tile_size, tile_overlap)  # fail at startup rather than on the first request
+        self.tile_size = tile_size
+        self.tile_overlap = tile_overlap
+        self.max_batch = max_batch
+        self.text_cache = text_cache
+        self.use_geoclip = use_geoclip
+        self.use_ocr = use_ocr
+        self.ocr_min_area = ocr_min_area
+        self.ocr_merge = ocr_merge
+        self.routes = dict(DEFAULT_ROUTES if routes is None else routes)
+        self.face_model = face_model
+        self.pool = pool
+        self._stage_timer = stage_timer
+        self._on_load = on_load
+
+        self.processor, self.gdino_model, self.gdino_backend = None, None, None
+        self.geo_model, self.gps_features = None, None
+        self.ocr_model = None
+        self.face_detector = None
+        self.prompt_cache, self.text_feature_cache = None, None
+        self.loaded = False
+        # Per-model readiness. OCR is optional, so it counts as ready once we
+        # have tried to load it, even if PaddleOCR is not installed.
+        self.status = {"gdino": False, "geoclip": False, "ocr": False, "faces": False}
+        self.load_seconds = {}
+
+        self.batcher = None
+        if pool is not None:
+            self.batcher = MicroBatcher(self.run_gdino_batch, max_batch_size=max_batch, max_wait_ms=max_wait_ms,
+                                        executor=pool.executor, on_wait=on_batch_wait)
+        # Set by use_model_client() in serve.py front processes, which hold no models
+        self.model_client = None
+        # Each thread keeps its last output buffer and reuses it while the image size stays the same
+        self._buffers = threading.local()
+
+    # --- Loading ---
+
+    def _timed(self, stage):
+        return self._stage_timer(stage) if self._stage_timer is not None else contextlib.nullcontext()
+
+    def _record_load(self, model, start):
+        self.load_seconds[model] = time.perf_counter() - start
+        if self._on_load is not None:
+            self._on_load(model, self.load_seconds[model])
+
+    def preload_weights(self):
+        """Loads the weights without warming them up.
+
+        serve.py --preload calls this in the supervisor before forking the
+        model workers, so the workers share one copy of the weights
+        copy-on-write.
+        """
+        if self.gdino_model is None:
+            start = time.perf_counter()
+            log.info("Loading Grounding DINO model...")
+            self.processor, self.gdino_model, self.gdino_backend = load_gdino(
+                self.device, self.backend, self.onnx_path, with_backend_name=True)
+            log.info("Grounding DINO loaded (backend: %s).", self.gdino_backend)
+            self._record_load("gdino", start)
+        if self.use_geoclip and self.geo_model is None:
+            start = time.perf_counter()
+            log.info("Loading GeoCLIP model...")
+            self.geo_model, self.gps_features = load_geoclip(self.device)
+            log.info("GeoCLIP model loaded.")
+            self._record_load("geoclip", start)
+
+    def load_cheap_detectors(self):
+        # The face detector has no weights to speak of, so serve.py front processes load it too
+        if self.face_detector is not None or not any("faces" in s for s in self.routes.values()):
+            return
+        start = time.perf_counter()
+        self.face_detector = load_face_detector(self.face_model)
+        if self.face_detector is None:
+            log.warning("Routing face categories to Grounding DINO instead.")
+            self.routes = {c: tuple(dict.fromkeys("gdino" if s == "faces" else s for s in stages))
+                           for c, stages in self.routes.items()}
+        else:
+            self._record_load("faces", start)
+
+    def load(self):
+        if self.loaded:
+            return self
+        self.load_cheap_detectors()
+        self.status["faces"] = True
+        self.preload_weights()
+        start = time.perf_counter()
+        self.warmup()
+        self._record_load("gdino_warmup", start)
+        self.status["gdino"] = True
+        self.status["geoclip"] = self.use_geoclip
+        if self.use_ocr:
+            start = time.perf_counter()
+            log.info("Loading PaddleOCR...")
+            self.ocr_model = try_ocr()
+            self._record_load("ocr", start)
+        self.status["ocr"] = True
+        self.loaded = True
+        return self
+
+    def warmup(self):
+        # Tokenize every prompt we know we will send and run them once through the
+        # model, which fills the text encoder cache and warms up the kernels.
+        gdino_categories = [c for c, stages in self.routes.items() if "gdino" in stages]
+        prompts = category_prompts(gdino_categories) + [prompt_text(DEFAULT_QUERIES)]
+        self.prompt_cache = PromptCache(self.processor.tokenizer, prompts)
+        # The text cache hooks into the PyTorch module, so it only applies to eager and int8
+        if self.text_cache and self.gdino_backend in ("eager", "int8"):
+            self.text_feature_cache = install_text_feature_cache(self.gdino_model, max_entries=2 * len(prompts))
+            if self.text_feature_cache is None:
+                log.warning("Grounding DINO text backbone not found; text features will not be cached.")
+        blank = Image.new("RGB", (320, 320))
+        for i in range(0, len(prompts), self.max_batch):
+            self.run_gdino_batch([(blank, [p]) for p in prompts[i:i + self.max_batch]], timed=False)
+        log.info("Grounding DINO warmed up with %d prompts.", len(prompts))
+
+    # --- Model stages ---
+
+    def run_gdino_batch(self, items, timed=True):
+        """One Grounding DINO forward pass over (img_pil, queries) items; returns (boxes, labels, scores) each."""
+        # Pre-tokenized prompts are only used when every prompt in the batch is one of them,
+        # since the cache pads and truncates to the longest prompt it was built with
+        cache = self.prompt_cache
+        if cache is not None and not all(prompt_text(q) in cache for _, q in items):
+            cache = None
+        with self._timed("gdino") if timed else contextlib.nullcontext():
+            return detect_gdino_batch(items, self.processor, self.gdino_model, self.device, self.box_threshold,
+                                      self.text_threshold, prompt_cache=cache, keep_labels=self.keep_labels)
+
+    def detect_gdino(self, img_pil, queries):
+        if self.tile_size <= 0:
+            return self.run_gdino_batch([(img_pil, queries)])[0]
+        items, offsets = tile_items(img_pil, queries, self.tile_size, self.tile_overlap)
+        results = []
+        for i in range(0, len(items), self.max_batch):
+            results.extend(self.run_gdino_batch(items[i:i + self.max_batch]))
+        return merge_tile_results(results, offsets)
+
+    def predict_location(self, img_pil):
+        # Returns ([lat, lon], [probability %]) rounded for the response
+        with self._timed("geoclip"):
+            top_pred_gps, top_pred_prob = predict_geoclip(img_pil, self.geo_model, self.gps_features, self.device)
+        gps = [round(v, 3) for v in top_pred_gps.tolist()[0]]
+        prob = [round(top_pred_prob.tolist()[0], 3) * 100]
+        return gps, prob
+
+    def detect_ocr(self, img_bgr, regions_only=False):
+        # With regions_only, OCR runs on the crops text_regions() proposes instead of the whole image.
+        # Boxes come back unfiltered: finish_ocr() applies ocr_min_area once they are at full resolution.
+        if self.ocr_model is None:
+            return no_boxes()
+        regions = None
+        if regions_only:
+            with self._timed("text_regions"):
+                regions = text_regions(img_bgr)
+        with self._timed("ocr"):
+            if regions is None:
+                return detect_ocr_boxes(img_bgr, self.ocr_model, min_area=0, merge=False)
+            found = [detect_ocr_boxes(img_bgr[y1:y2, x1:x2], self.ocr_model, min_area=0, merge=False)
+                     + [x1, y1, x1, y1] for x1, y1, x2, y2 in regions.tolist()]
+            return np.concatenate(found).astype(int) if found else no_boxes()
+
+    def finish_ocr(self, boxes):
+        """Applies ocr_min_area and ocr_merge to OCR boxes already scaled to the input image."""
+        return filter_ocr_boxes(boxes, self.ocr_min_area, self.ocr_merge)
+
+    def detect_faces(self, img_bgr):
+        if self.face_detector is None:
+            return no_boxes()
+        with self._timed("faces"):
+            return self.face_detector(img_bgr)
+
+    def plan(self, categories):
+        """Routes the requested categories: returns the Grounding DINO queries and the other stages to run."""
+        requested = [c for c in self.routes if c in categories]
+        gdino = {c for c in requested if "gdino" in self.routes[c]}
+        # Follow CATEGORY_QUERIES order so the prompt matches one warmup() cached
+        queries = [q for c in CATEGORY_QUERIES if c in gdino for q in CATEGORY_QUERIES[c]]
+        stages = {s for c in requested for s in self.routes[c] if s != "gdino"}
+        if self.ocr_model is None and self.model_client is None:
+            stages -= {"ocr", "ocr_regions"}
+        if "ocr" in stages:
+            stages.discard("ocr_regions")  # the whole image is already being read
+        return queries, stages
+
+    def _plan(self, queries, categories):
+        if categories is not None:
+            return self.plan(categories)
+        return (DEFAULT_QUERIES if queries is None else queries), {"ocr"} if self.ocr_model is not None else set()
+
+    def _run_stages(self, img_det, stages):
+        # The cheap and OCR stages of a plan, as [ocr boxes, face boxes]
+        boxes_ocr = self.detect_ocr(img_det, "ocr" not in stages) if stages & {"ocr", "ocr_regions"} else no_boxes()
+        boxes_faces = self.detect_faces(img_det) if "faces" in stages else no_boxes()
+        return [boxes_ocr, boxes_faces]
+
+    def detection_copy(self, img_bgr):
+        """The detection-sized BGR copy and its RGB PIL twin."""
+        img_det = resize_for_detection(img_bgr, self.detect_max_side)
+        return img_det, ingest.to_pil(img_det)
+
+    # --- Sync and batch entry points ---
+
+    def detect(self, img_bgr, queries=None, categories=None):
+        """Runs every detector the request needs on a full-resolution BGR image.
+
+        Pass either categories (as the app sends them) or a list of
+        Grounding DINO queries; with neither, DEFAULT_QUERIES and OCR are
+        used. Returns {"boxes": [gdino, ocr, faces], "labels", "gps",
+        "probability"} with boxes in img_bgr coordinates; gps and
+        probability are None without GeoCLIP.
+        """
+        return self.detect_batch([img_bgr], queries, categories)[0]
+
+    def detect_batch(self, images, queries=None, categories=None):
+        """detect() for a list of images, sharing Grounding DINO forward passes between them."""
+        self.load()
+        queries, stages = self._plan(queries, categories)
+        copies = [self.detection_copy(img) for img in images]
+        if not queries:
+            gd_results = [(no_boxes(), [], np.empty((0,)))] * len(images)
+        elif self.tile_size > 0:
+            gd_results = [self.detect_gdino(img_pil, queries) for _, img_pil in copies]
+        else:
+            gd_results = []
+            for i in range(0, len(copies), self.max_batch):
+                gd_results.extend(self.run_gdino_batch([(p, queries) for _, p in copies[i:i + self.max_batch]]))
+        detections = []
+        for img_bgr, (img_det, img_pil), (boxes_gd, labels, _) in zip(images, copies, gd_results):
+            box_lists = [rescale_boxes(b, img_det.shape, img_bgr.shape)
+                         for b in [boxes_gd] + self._run_stages(img_det, stages)]
+            box_lists[1] = self.finish_ocr(box_lists[1])
+            gps, prob = self.predict_location(img_pil) if self.use_geoclip else (None, None)
+            detections.append({"boxes": box_lists, "labels": labels, "gps": gps, "probability": prob})
+        return detections
+
+    def redact_image(self, img_bgr, box_lists, method="blur", blur_ksize=151, mosaic_scale=0.06, out=None):
+        with self._timed("mask"):
+            mask = union_masks(img_bgr.shape, box_lists, value=255)
+        with self._timed("redact"):
+            return redact(img_bgr, mask, method, blur_ksize, mosaic_scale, out=out)
+
+    def encode(self, img_bgr, image_format="jpeg", quality=90):
+        ext, _, quality_flag = IMAGE_FORMATS[image_format]
+        with self._timed("encode"):
+            ok, encoded = cv2.imencode(ext, img_bgr, [quality_flag, quality] if quality_flag is not None else [])
+        if not ok:
+            raise ValueError(f"Could not encode the redacted image as {image_format}.")
+        return encoded.tobytes()
+
+    def render(self, img_bgr, box_lists, method="blur", blur_ksize=151, mosaic_scale=0.06, image_format="jpeg",
+               quality=90):
+        """Redacts the boxes and returns the encoded image bytes."""
+        out = getattr(self._buffers, "out", None)
+        if out is None or out.shape != img_bgr.shape:
+            out = self._buffers.out = np.empty_like(img_bgr)
+        redacted = self.redact_image(img_bgr, box_lists, method, blur_ksize, mosaic_scale, out=out)
+        return self.encode(redacted, image_format, quality)
+
+    def decode(self, image_bytes):
+        with self._timed("decode"):
+            return ingest.load_image(image_bytes, self.max_pixels)
+
+    def _decode_for_detection(self, image_bytes, with_pil=True):
+        with self._timed("decode_detect"):
+            img_det, is_full_res = ingest.load_image_for_detection(image_bytes, self.detect_max_side,
+                                                                   self.max_pixels)
+            img_pil = ingest.to_pil(img_det) if with_pil else None
+        return img_det, img_pil, is_full_res
+
+    # --- Async entry points (need a WorkerPool) ---
+
+    def use_model_client(self, client):
+        # serve.py front processes: models live in the model workers, reached through client
+        self.model_client = client
+
+    async def start(self):
+        self.load_cheap_detectors()
+        if self.model_client is not None:
+            await self.model_client.start()
+
+    async def load_async(self):
+        # Front processes under serve.py hold no models; the model workers load them
+        if self.model_client is None:
+            self.load()
+
+    async def _remote_call(self, op, frame, **kwargs):
+        # Recorded from the front, so it includes the wait for a free model worker
+        with self._timed(f"{op}_remote"):
+            return await self.model_client.call(op, frame, **kwargs)
+
+    async def _gdino_async(self, img_pil, queries, frame=None):
+        # Remotely img_pil is None and frame is the shared-memory detection copy
+        width, height = img_pil.size if frame is None else (frame.shape[1], frame.shape[0])
+        windows = tile_grid(width, height, self.tile_size, self.tile_overlap) if self.tile_size > 0 else []
+
+        def submit(window):
+            if frame is not None:
+                return self._remote_call("gdino", frame, queries=queries, window=window)
+            return self.batcher.submit((img_pil if window is None else img_pil.crop(window), queries))
+
+        if len(windows) <= 1:
+            return await submit(None)
+        windows = [tuple(int(v) for v in win) for win in windows]
+        offsets = [(x1, y1) for x1, y1, _, _ in windows] + [(0, 0)]
+        results = await _gather_all(*[submit(win) for win in windows], submit(None))
+        # Objects cut by a tile seam show up once per tile; fold them back into one box
+        return merge_tile_results(results, offsets)
+
+    async def detect_async(self, image_bytes, categories, progress=None):
+        """detect() for raw upload bytes, without blocking the event loop.
+
+        Returns the detection and the full-resolution image. A detection-sized
+        copy is decoded first so the detectors can start right away; the
+        full-resolution decode runs alongside them. progress, if given, is
+        called as progress(stage, pending) after the decode and after each
+        detector finishes, with the names of the detectors still running.
+        """
+        remote = self.model_client is not None
+        img_det, img_pil, is_full_res = await self.pool.run(self._decode_for_detection, image_bytes, not remote)
+        full_decode = None if is_full_res else asyncio.ensure_future(self.pool.run(self.decode, image_bytes))
+
+        queries, stages = self.plan(categories)
+        log.debug("Grounding DINO queries: %s, other stages: %s", queries, sorted(stages))
+        run_ocr = bool(stages & {"ocr", "ocr_regions"})
+        regions_only = "ocr" not in stages
+        pending = {name for name, run in (("geoclip", self.use_geoclip), ("gdino", bool(queries)),
+                                          ("ocr", run_ocr), ("faces", "faces" in stages)) if run}
+        if progress is not None:
+            progress("decode", sorted(pending))
+
+        def stage(name, aw):
+            if progress is None:
+                return aw
+
+            async def reported():
+                result = await aw
+                pending.discard(name)
+                progress(name, sorted(pending))
+                return result
+            return reported()
+
+        # Faces run on the pool in every process; the detector is cheap enough for a front
+        faces = stage("faces", self.pool.run(self.detect_faces, img_det)) if "faces" in stages else _no_boxes()
+        # The detectors only read the decoded image, so run them side by side on the
+        # worker pool (or the serve.py model workers) and join before building the mask.
+        if not remote:
+            (gps, prob), (boxes_gd, labels, _), boxes_ocr, boxes_faces = await asyncio.gather(
+                stage("geoclip", self.pool.run(self.predict_location, img_pil)) if self.use_geoclip
+                else _no_location(),
+                stage("gdino", self._gdino_async(img_pil, queries)) if queries else _no_gdino(),
+                stage("ocr", self.pool.run(self.detect_ocr, img_det, regions_only)) if run_ocr else _no_boxes(),
+                faces,
+            )
+        else:
+            # Every call must be over before the block hands the shared-memory slot back
+            async with self.model_client.frame(img_det) as frame:
+                (gps, prob), (boxes_gd, labels, _), boxes_ocr, boxes_faces = await _gather_all(
+                    stage("geoclip", self._remote_call("geoclip", frame)) if self.use_geoclip else _no_location(),
+                    stage("gdino", self._gdino_async(None, queries, frame)) if queries else _no_gdino(),
+                    stage("ocr", self._remote_call("ocr", frame, regions_only=regions_only)) if run_ocr
+                    else _no_boxes(),
+                    faces,
+                )
+        img_bgr = await full_decode if full_decode is not None else img_det
+        log.debug("GeoCLIP prediction: %s (%s%%)", gps, prob)
+        box_lists = [rescale_boxes(b, img_det.shape, img_bgr.shape) for b in (boxes_gd, boxes_ocr, boxes_faces)]
+        box_lists[1] = self.finish_ocr(box_lists[1])
+        detection = {"boxes": box_lists, "labels": list(labels), "gps": gps, "probability": prob}
+        return detection, img_bgr
+
+    async def decode_async(self, image_bytes):
+        return await self.pool.run(self.decode, image_bytes)
+
+    async def render_async(self, img_bgr, box_lists, **render):
+        return await self.pool.run(self.render, img_bgr, box_lists, **render)
+
+    async def aclose(self):
+        if self.batcher is not None:
+            await self.batcher.stop()
+        if self.model_client is not None:
+            self.model_client.close()
+
+    # --- serve.py model workers ---
+
+    def worker_ops(self, device, cores):
+        """serve.py model-worker init: loads the models in this process and returns (ops, batch_ops)."""
+        if device:
+            self.device = device
+        if cores:
+            torch.set_num_threads(len(cores))
+            cv2.setNumThreads(len(cores))
+        self.load()
+
+        def gdino_batch(calls):
+            items = []
+            for frame, kwargs in calls:
+                window = kwargs.get("window")
+                if window is not None:
+                    x1, y1, x2, y2 = window
+                    frame = frame[y1:y2, x1:x2]
+                items.append((ingest.to_pil(frame), kwargs["queries"]))
+            return self.run_gdino_batch(items)
+
+        ops = {"geoclip": lambda frame: self.predict_location(ingest.to_pil(frame)), "ocr": self.detect_ocr}
+        return ops, {"gdino": gdino_batch}
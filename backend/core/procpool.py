@@ -0,0 +1,242 @@
+# backend/core/procpool.py
+#
+# Model-worker processes fed through shared memory. Several HTTP front processes
+# submit work to one task queue; each worker process holds its own copy of the
+# models (or a copy-on-write view of the supervisor's) and pulls from that queue.
+# Frames travel as a shared-memory slot name plus a shape, never through a pipe.
+
+import asyncio
+import collections
+import contextlib
+import importlib
+import itertools
+import logging
+import os
+import queue
+import signal
+import threading
+from multiprocessing import shared_memory
+
+import numpy as np
+
+log = logging.getLogger(__name__)
+
+
+class Frame(collections.namedtuple("Frame", ["name", "shape", "pooled"])):
+    """Handle to a uint8 image in shared memory, as sent to the model workers.
+
+    pooled is False for one-off segments, which workers detach from as soon as
+    they are done with them instead of keeping the mapping for reuse.
+    """
+
+
+def _attach(name):
+    # Workers only borrow the segment; the front that created it unlinks it. Before
+    # Python 3.13 attaching also registers the segment with the resource tracker,
+    # which would unlink it when the worker exits, so undo that.
+    try:
+        return shared_memory.SharedMemory(name=name, track=False)
+    except TypeError:
+        shm = shared_memory.SharedMemory(name=name)
+        from multiprocessing import resource_tracker
+        resource_tracker.unregister(shm._name, "shared_memory")
+        return shm
+
+
+def core_sets(n_workers, cores_per_worker, cores=None):
+    """Splits the usable cores into n_workers disjoint blocks; returns (worker_sets, leftover)."""
+    cores = sorted(cores if cores is not None else os.sched_getaffinity(0))
+    if cores_per_worker <= 0:
+        cores_per_worker = max(1, len(cores) // max(1, n_workers))
+    if n_workers * cores_per_worker > len(cores):
+        raise ValueError(f"{n_workers} workers x {cores_per_worker} cores needs more than the {len(cores)} available")
+    sets = [cores[i * cores_per_worker:(i + 1) * cores_per_worker] for i in range(n_workers)]
+    return sets, cores[n_workers * cores_per_worker:]
+
+
+def worker_main(index, init, init_kwargs, cores, device, tasks, results, ready, max_batch, max_segments=64):
+    """Entry point of a model-worker process.
+
+    init (a callable, or "module:function" so spawned workers import it
+    themselves) is called as init(device, cores, **init_kwargs); it loads the
+    models and returns (ops, batch_ops). ops maps a name to fn(frame, **kwargs);
+    batch_ops maps a name to fn([(frame, kwargs), ...]) returning one result per
+    call, so concurrent requests for it share one forward pass. ready[index]
+    is set to 1 once the models are loaded.
+
+    Pooled segments stay mapped between calls, up to max_segments of them
+    (set it to the number of slots across all fronts). Past that the least
+    recently used are closed, which is how slots a front has retired get
+    unmapped: they are never sent again.
+    """
+    # The supervisor stops workers through the task queue; ignore a Ctrl-C sent to the whole group
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    if cores:
+        os.sched_setaffinity(0, cores)
+    if isinstance(init, str):
+        module, name = init.split(":")
+        init = getattr(importlib.import_module(module), name)
+    ops, batch_ops = init(device, cores, **init_kwargs)
+    ready[index] = 1
+    log.info("Model worker %d ready on %s (cores %s)", index, device, cores or "any")
+    segments = collections.OrderedDict()  # segment name -> mapping, least recently used first
+    while True:
+        msg = tasks.get()
+        if msg is None:
+            break
+        # Take whatever else is already queued, up to max_batch, so batchable ops can share a pass
+        batch = [msg]
+        while len(batch) < max_batch:
+            try:
+                msg = tasks.get_nowait()
+            except queue.Empty:
+                break
+            if msg is None:
+                tasks.put(None)  # leave the stop signal for after this batch
+                break
+            batch.append(msg)
+        by_op = collections.defaultdict(list)
+        for front, task_id, op, frame, kwargs in batch:
+            by_op[op].append((front, task_id, frame, kwargs))
+        for op, calls in by_op.items():
+            try:
+                arrays = []
+                for _, _, frame, kwargs in calls:
+                    if frame.name in segments:
+                        segments.move_to_end(frame.name)
+                    else:
+                        segments[frame.name] = _attach(frame.name)
+                    arrays.append(np.ndarray(frame.shape, np.uint8, buffer=segments[frame.name].buf))
+                if op in batch_ops:
+                    outputs = batch_ops[op](list(zip(arrays, [kw for _, _, _, kw in calls])))
+                else:
+                    outputs = [ops[op](array, **kwargs) for array, (_, _, _, kwargs) in zip(arrays, calls)]
+                replies = [(True, out) for out in outputs]
+            except Exception as e:
+                log.exception("Model worker %d failed on %s", index, op)
+                replies = [(False, f"{type(e).__name__}: {e}")] * len(calls)
+            finally:
+                arrays = None  # views into the segments must go before they can be closed
+            for (front, task_id, _, _), (ok, out) in zip(calls, replies):
+                results[front].put((task_id, ok, out))
+        for _, _, _, frame, _ in batch:
+            if not frame.pooled and frame.name in segments:
+                segments.pop(frame.name).close()
+        while len(segments) > max_segments:
+            segments.popitem(last=False)[1].close()
+    for shm in segments.values():
+        shm.close()
+
+
+class ModelClient:
+    """Front-process side: copies frames into shared-memory slots and awaits worker results.
+
+    Each front owns n_slots slots of slot_bytes each, created on start();
+    frames larger than a slot get a one-off segment. Results come back on
+    this front's own queue and are handed to the event loop by a reader thread.
+    """
+
+    def __init__(self, front, tasks, results, ready, n_workers, n_slots=16, slot_bytes=1333 * 1333 * 3,
+                 timeout=120.0):
+        self.front = front
+        self.tasks = tasks
+        self.results = results
+        self._ready = ready
+        self.n_workers = n_workers
+        self.n_slots = n_slots
+        self.slot_bytes = slot_bytes
+        self.timeout = timeout
+        self._slots = []
+        self._free = None
+        self._busy = set()  # slots a worker may still be reading after a call gave up waiting
+        self._pending = {}
+        self._ids = itertools.count()
+        self._loop = None
+        self._reader = None
+
+    def workers_ready(self):
+        return sum(self._ready[:])
+
+    async def start(self):
+        self._loop = asyncio.get_running_loop()
+        if self.slot_bytes > 0:
+            self._slots = [shared_memory.SharedMemory(create=True, size=self.slot_bytes) for _ in range(self.n_slots)]
+        self._free = asyncio.Queue()
+        for shm in self._slots:
+            self._free.put_nowait(shm)
+        self._reader = threading.Thread(target=self._read_results, name="model-results", daemon=True)
+        self._reader.start()
+
+    def _read_results(self):
+        while True:
+            msg = self.results.get()
+            if msg is None:
+                return
+            self._loop.call_soon_threadsafe(self._resolve, *msg)
+
+    def _resolve(self, task_id, ok, payload):
+        future = self._pending.pop(task_id, None)
+        if future is None or future.done():
+            return  # the caller timed out or went away
+        if ok:
+            future.set_result(payload)
+        else:
+            future.set_exception(RuntimeError(f"Model worker error: {payload}"))
+
+    @contextlib.asynccontextmanager
+    async def frame(self, img):
+        """Copies a uint8 image into shared memory for the duration of the block.
+
+        Callers must wait for every call on the frame before leaving the block.
+        A call that timed out or was cancelled may still be read by a worker,
+        so its slot is retired instead of going back to the free list.
+        """
+        img = np.ascontiguousarray(img, dtype=np.uint8)
+        if img.nbytes > self.slot_bytes:
+            shm, pooled = shared_memory.SharedMemory(create=True, size=img.nbytes), False
+        else:
+            shm, pooled = await self._free.get(), True
+        try:
+            np.ndarray(img.shape, np.uint8, buffer=shm.buf)[...] = img
+            yield Frame(shm.name, img.shape, pooled)
+        finally:
+            if not pooled:
+                shm.close()
+                shm.unlink()
+            elif shm.name in self._busy:
+                self._busy.discard(shm.name)
+                self._retire(shm)
+            else:
+                self._free.put_nowait(shm)
+
+    def _retire(self, shm):
+        # Unlinking keeps the late worker's mapping valid, and the next request gets a
+        # fresh slot instead of one it could overwrite mid-read
+        log.warning("Retiring shared-memory slot %s: a model worker may still be reading it", shm.name)
+        self._slots.remove(shm)
+        shm.close()
+        shm.unlink()
+        fresh = shared_memory.SharedMemory(create=True, size=self.slot_bytes)
+        self._slots.append(fresh)
+        self._free.put_nowait(fresh)
+
+    async def call(self, op, frame, **kwargs):
+        task_id = next(self._ids)
+        future = self._loop.create_future()
+        self._pending[task_id] = future
+        self.tasks.put((self.front, task_id, op, frame, kwargs))
+        try:
+            return await asyncio.wait_for(future, self.timeout)
+        except (asyncio.TimeoutError, asyncio.CancelledError):
+            # No reply yet, so a worker may still be reading the frame
+            self._busy.add(frame.name)
+            raise
+        finally:
+            self._pending.pop(task_id, None)
+
+    def close(self):
+        self.results.put(None)
+        for shm in self._slots:
+            shm.close()
+            shm.unlink()
+        self._slots = []
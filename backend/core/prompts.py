@@ -0,0 +1,123 @@
+# backend/core/prompts.py
+
+import threading
+from collections import OrderedDict
+
+import torch
+from transformers.modeling_outputs import BaseModelOutput
+
+
+def prompt_text(queries):
+    # Grounding DINO wants one lowercase string with phrases separated by periods
+    return ". ".join(q.lower().strip().rstrip(".") for q in queries) + "."
+
+
+class PromptCache:
+    """Tokenized Grounding DINO prompts, computed once per prompt string.
+
+    Every prompt is padded to the same max_length, so a given prompt always
+    yields identical input_ids/attention_mask rows no matter which other
+    prompts share its batch. That makes the rows safe to reuse, and lets
+    CachedTextBackbone reuse the text encoder output for them as well.
+    Safe to share between threads.
+    """
+
+    def __init__(self, tokenizer, prompts, max_entries=256):
+        self.tokenizer = tokenizer
+        self.max_entries = max_entries
+        self.max_length = max(len(tokenizer(p)["input_ids"]) for p in prompts)
+        self._rows = OrderedDict()
+        self._lock = threading.Lock()
+        for p in prompts:
+            self._encode(p)
+
+    def _encode(self, text):
+        with self._lock:
+            rows = self._rows.get(text)
+            if rows is not None:
+                self._rows.move_to_end(text)
+                return rows
+        rows = self.tokenizer(text, padding="max_length", truncation=True,
+                              max_length=self.max_length, return_tensors="pt")
+        with self._lock:
+            self._rows[text] = rows
+            if len(self._rows) > self.max_entries:
+                self._rows.popitem(last=False)
+        return rows
+
+    def __contains__(self, text):
+        return text in self._rows
+
+    def __call__(self, texts):
+        """Returns the stacked tokenizer outputs for a list of prompt strings."""
+        rows = [self._encode(t) for t in texts]
+        return {key: torch.cat([r[key] for r in rows]) for key in rows[0].keys()}
+
+
+class CachedTextBackbone(torch.nn.Module):
+    """Wraps Grounding DINO's BERT text backbone and memoizes its output per prompt row.
+
+    The text branch only depends on the token rows, which PromptCache keeps
+    fixed for each prompt, so for repeated prompts the encoder output is
+    looked up instead of recomputed. Only used for inference. The cache is
+    locked, since the Flask app and the worker pool call the model from
+    several threads; the backbone itself runs outside the lock.
+    """
+
+    def __init__(self, backbone, max_entries=64):
+        super().__init__()
+        self.backbone = backbone
+        self.max_entries = max_entries
+        self._cache = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def _row_key(i, *tensors):
+        return b"|".join(t[i].cpu().numpy().tobytes() for t in tensors if t is not None)
+
+    def forward(self, input_ids, attention_mask=None, token_type_ids=None, position_ids=None, **kwargs):
+        keys = [self._row_key(i, input_ids, attention_mask, token_type_ids, position_ids)
+                for i in range(input_ids.shape[0])]
+        rows = {}
+        missing = []
+        with self._lock:
+            for i, k in enumerate(keys):
+                if k in rows:
+                    continue
+                rows[k] = self._cache.get(k)
+                if rows[k] is None:
+                    missing.append(i)
+                else:
+                    self._cache.move_to_end(k)
+            self.hits += len(keys) - len(missing)
+            self.misses += len(missing)
+        if missing:
+            idx = torch.tensor(missing, device=input_ids.device)
+            pick = lambda t: t.index_select(0, idx) if t is not None else None
+            outputs = self.backbone(pick(input_ids), attention_mask=pick(attention_mask),
+                                    token_type_ids=pick(token_type_ids), position_ids=pick(position_ids))
+            hidden = outputs[0].detach()
+            with self._lock:
+                for j, i in enumerate(missing):
+                    rows[keys[i]] = self._cache[keys[i]] = hidden[j:j + 1]
+                    if len(self._cache) > self.max_entries:
+                        self._cache.popitem(last=False)
+        return BaseModelOutput(last_hidden_state=torch.cat([rows[k] for k in keys]))
+
+
+def install_text_feature_cache(model, max_entries=64):
+    """Swaps in CachedTextBackbone if this Grounding DINO build exposes its text backbone.
+
+    Returns the wrapper, or None when the model layout is not the one we know.
+    """
+    inner = getattr(model, "model", None)
+    backbone = getattr(inner, "text_backbone", None)
+    if backbone is None:
+        return None
+    if isinstance(backbone, CachedTextBackbone):
+        return backbone
+    cached = CachedTextBackbone(backbone, max_entries=max_entries)
+    inner.text_backbone = cached
+    return cached
@@ -1,59 +1,146 @@
 # backend/core/redactor.py
 
-import os
-import requests
+import logging
 import numpy as np
-import cv2
 import torch
+import torch.nn.functional as F
 from PIL import Image
 from transformers import AutoProcessor, AutoModelForZeroShotObjectDetection
+from core.backends import apply_backend
+from core.prompts import prompt_text
+from core.boxes import merge_overlaps, polygons_to_boxes, label_keep_mask, box_areas, tile_grid
+
+log = logging.getLogger(__name__)
+
+GDINO_MODEL_ID = "IDEA-Research/grounding-dino-base"
+
+# Grounding DINO labels we keep; anything else the model returns is dropped
+KEEP_LABEL_KEYWORDS = ["sign", "flag", "board", "landmark", "monument", "person", "child"]
 
 # --- Core Logic Functions (from your original code) ---
-def load_image(path_or_url):
-    if str(path_or_url).startswith(("http://", "https://")):
-        resp = requests.get(path_or_url, stream=True)
-        resp.raise_for_status()
-        img = Image.open(resp.raw).convert("RGB")
-    else:
-        if not os.path.isfile(path_or_url):
-            raise FileNotFoundError(path_or_url)
-        img = Image.open(path_or_url).convert("RGB")
-    return img
-
-def load_gdino(device):
-    processor = AutoProcessor.from_pretrained("IDEA-Research/grounding-dino-base")
-    model = AutoModelForZeroShotObjectDetection.from_pretrained("IDEA-Research/grounding-dino-base").to(device)
+def load_gdino(device, backend="eager", onnx_path=None, with_backend_name=False):
+    processor = AutoProcessor.from_pretrained(GDINO_MODEL_ID)
+    model = AutoModelForZeroShotObjectDetection.from_pretrained(GDINO_MODEL_ID).to(device)
     model.eval()
+    active = "eager"
+    if backend != "eager":
+        sample_inputs = processor(images=Image.new("RGB", (640, 480)), text="street name sign. flag.", return_tensors="pt")
+        # A different prompt and size, so the smoke test catches anything frozen at export
+        check_inputs = processor(images=Image.new("RGB", (480, 720)), text="face. license plate. house number.",
+                                 return_tensors="pt")
+        model, active = apply_backend(model, backend, device, onnx_path, sample_inputs, check_inputs)
+    if with_backend_name:
+        return processor, model, active
     return processor, model
 
-def detect_gdino(img_pil, processor, model, device, box_thresh, text_thresh, queries):
-    w, h = img_pil.size
-    inputs = processor(
-        images=img_pil,
-        text=[q.lower().strip() for q in queries],
-        padding=True, truncation=True, return_tensors="pt"
-    ).to(device)
+def load_geoclip(device):
+    # Imported here so the Grounding DINO-only tools do not need geoclip installed
+    from geoclip import GeoCLIP
+    geo_model = GeoCLIP().to(device)
+    geo_model.eval()
+    # The GPS gallery is fixed, so encode it once instead of on every predict() call.
+    with torch.no_grad():
+        gps_gallery = geo_model.gps_gallery.to(device)
+        gps_features = F.normalize(geo_model.location_encoder(gps_gallery), dim=1)
+    return geo_model, gps_features
+
+def predict_geoclip(img_pil, geo_model, gps_features, device, top_k=1):
+    # Same as GeoCLIP.predict, but takes a decoded PIL image instead of a file path
+    # and reuses the gallery features computed in load_geoclip.
+    image = geo_model.image_encoder.preprocess_image(img_pil).to(device)
+    with torch.no_grad():
+        image_features = F.normalize(geo_model.image_encoder(image), dim=1)
+        logits = geo_model.logit_scale.exp() * (image_features @ gps_features.t())
+        probs = logits.softmax(dim=-1).cpu()
+    top_pred = torch.topk(probs, top_k, dim=1)
+    top_pred_gps = geo_model.gps_gallery[top_pred.indices[0]]
+    top_pred_prob = top_pred.values[0]
+    return top_pred_gps, top_pred_prob
+
+def detect_gdino(img_pil, processor, model, device, box_thresh, text_thresh, queries,
+                 keep_labels=KEEP_LABEL_KEYWORDS):
+    return detect_gdino_batch([(img_pil, queries)], processor, model, device, box_thresh, text_thresh,
+                              keep_labels=keep_labels)[0]
+
+def detect_gdino_batch(items, processor, model, device, box_thresh, text_thresh, prompt_cache=None,
+                       keep_labels=KEEP_LABEL_KEYWORDS):
+    """Runs one processor call and one forward pass for a list of (img_pil, queries).
+
+    Each item keeps its own prompt and target size; returns a list of
+    (boxes, labels, scores) in the same order as items. With a PromptCache
+    only the images are preprocessed. keep_labels=None keeps every label.
+    """
+    images = [img for img, _ in items]
+    texts = [prompt_text(queries) for _, queries in items]
+    if prompt_cache is not None:
+        inputs = processor.image_processor(images, return_tensors="pt")
+        inputs.update(prompt_cache(texts))
+        inputs = inputs.to(device)
+    else:
+        inputs = processor(
+            images=images,
+            text=texts,
+            padding=True, truncation=True, return_tensors="pt"
+        ).to(device)
     with torch.no_grad():
         outputs = model(**inputs)
-    result = processor.post_process_grounded_object_detection(
+    results = processor.post_process_grounded_object_detection(
         outputs=outputs,
         input_ids=inputs.input_ids,
         box_threshold=box_thresh,
         text_threshold=text_thresh,
-        target_sizes=[(h, w)]
-    )[0]
+        target_sizes=[img.size[::-1] for img in images]
+    )
+    return [_filter_gdino_result(result, keep_labels) for result in results]
+
+def tile_items(img_pil, queries, tile_size, overlap=0.2, include_full=True):
+    """Splits an image into overlapping tiles for Grounding DINO.
+
+    Returns the (tile, queries) items and the (dx, dy) offset of each; with
+    include_full the whole image is appended as a last item at offset (0, 0).
+    """
+    w, h = img_pil.size
+    windows = tile_grid(w, h, tile_size, overlap)
+    items = [(img_pil.crop(win), queries) for win in windows]
+    offsets = [(int(x1), int(y1)) for x1, y1, _, _ in windows]
+    if include_full and len(windows) > 1:
+        items.append((img_pil, queries))
+        offsets.append((0, 0))
+    return items, offsets
+
+def merge_tile_results(results, offsets, merge_iou=0.1):
+    """Maps per-tile (boxes, labels, scores) back to image coordinates and merges duplicates.
+
+    Boxes cut by tile seams are merged with merge_overlaps; each merged box
+    keeps the label and score of its highest-scoring member.
+    """
+    all_boxes, all_labels, all_scores = [], [], []
+    for (boxes, labels, scores), (dx, dy) in zip(results, offsets):
+        all_boxes.append(boxes.reshape(-1, 4) + [dx, dy, dx, dy])
+        all_labels.extend(labels)
+        all_scores.append(scores)
+    boxes = np.concatenate(all_boxes).astype(int)
+    scores = np.concatenate(all_scores)
+    if len(boxes) == 0:
+        return boxes, [], scores
+    merged, groups = merge_overlaps(boxes, iou_thresh=merge_iou, return_groups=True)
+    best = np.full(len(merged), -1)
+    for i in np.argsort(-scores):
+        if best[groups[i]] < 0:
+            best[groups[i]] = i
+    return merged, [all_labels[i] for i in best], scores[best]
+
+def _filter_gdino_result(result, keep_labels=KEEP_LABEL_KEYWORDS):
     boxes = result["boxes"].cpu().numpy().astype(int) if len(result["boxes"]) else np.empty((0, 4), dtype=int)
     labels = result["labels"]
     scores = result["scores"].cpu().numpy() if len(result["scores"]) else np.empty((0,))
-    
-    keep = []
-    for i, lab in enumerate(labels):
-        lab_l = lab.lower()
-        if any(k in lab_l for k in ["sign", "flag", "board", "landmark", "monument", "person", "child"]):
-            keep.append(i)
-    boxes = boxes[keep]
-    labels = [labels[i] for i in keep]
-    scores = scores[keep] if len(keep) else np.empty((0,))
+    if keep_labels is None:
+        return boxes, list(labels), scores
+
+    keep = label_keep_mask(labels, keep_labels)
+    boxes = boxes[keep] if len(boxes) else boxes
+    labels = [lab for lab, k in zip(labels, keep) if k]
+    scores = scores[keep] if len(scores) else scores
     return boxes, labels, scores
 
 def try_ocr():
@@ -61,90 +148,28 @@ def try_ocr():
         from paddleocr import PaddleOCR
         return PaddleOCR(use_angle_cls=True, lang='en', show_log=False)
     except Exception as e:
-        print(f"PaddleOCR not available ({e}); continuing without OCR.")
+        log.warning("PaddleOCR not available (%s); continuing without OCR.", e)
         return None
 
 def detect_ocr_boxes(img_bgr, ocr, min_area=4000, merge=True):
     if ocr is None:
         return np.empty((0, 4), dtype=int)
     h, w = img_bgr.shape[:2]
-    res = ocr.ocr(img_bgr[..., ::-1], cls=True)
-    boxes = []
+    # PaddleOCR takes arrays in OpenCV's BGR order, the same as cv2.imread gives it
+    res = ocr.ocr(img_bgr, cls=True)
+    polys = []
     if res and isinstance(res, list):
         for page in res:
             if page is None: continue
-            for det in page:
-                poly = np.array(det[0]).astype(int)
-                x1, y1 = poly.min(axis=0)
-                x2, y2 = poly.max(axis=0)
-                x1, y1 = max(0, x1), max(0, y1)
-                x2, y2 = min(w - 1, x2), min(h - 1, y2)
-                area = (x2 - x1) * (y2 - y1)
-                if area >= min_area:
-                    boxes.append([x1, y1, x2, y2])
-    boxes = np.array(boxes, dtype=int) if boxes else np.empty((0, 4), dtype=int)
+            polys.extend(det[0] for det in page)
+    boxes = polygons_to_boxes(polys).astype(int)
+    boxes[:, [0, 2]] = boxes[:, [0, 2]].clip(0, w - 1)
+    boxes[:, [1, 3]] = boxes[:, [1, 3]].clip(0, h - 1)
+    return filter_ocr_boxes(boxes, min_area, merge)
+
+def filter_ocr_boxes(boxes, min_area=4000, merge=True):
+    # Drops boxes under min_area pixels, then merges overlapping lines into blocks
+    boxes = boxes[box_areas(boxes) >= min_area]
     if merge and len(boxes) > 0:
         boxes = merge_overlaps(boxes, iou_thresh=0.2)
     return boxes
-
-def merge_overlaps(boxes, iou_thresh=0.2):
-    boxes = boxes.tolist()
-    merged = []
-    while boxes:
-        b = boxes.pop(0)
-        group = [b]
-        rest = []
-        for c in boxes:
-            if iou(b, c) > iou_thresh:
-                group.append(c)
-            else:
-                rest.append(c)
-        x1 = min(t[0] for t in group)
-        y1 = min(t[1] for t in group)
-        x2 = max(t[2] for t in group)
-        y2 = max(t[3] for t in group)
-        merged.append([x1, y1, x2, y2])
-        boxes = rest
-    return np.array(merged, dtype=int)
-
-def iou(a, b):
-    xa1, ya1, xa2, ya2 = a
-    xb1, yb1, xb2, yb2 = b
-    inter_w = max(0, min(xa2, xb2) - max(xa1, xb1))
-    inter_h = max(0, min(ya2, yb2) - max(ya1, yb1))
-    inter = inter_w * inter_h
-    if inter == 0:
-        return 0.0
-    area_a = (xa2 - xa1) * (ya2 - ya1)
-    area_b = (xb2 - xb1) * (yb2 - yb1)
-    return inter / float(area_a + area_b - inter)
-
-def union_masks(img_shape, list_of_boxes_lists):
-    H, W = img_shape[:2]
-    mask = np.zeros((H, W), dtype=np.uint8)
-    for boxes in list_of_boxes_lists:
-        for x1, y1, x2, y2 in boxes:
-            mask[y1:y2, x1:x2] = 1
-    return mask
-
-def redact(img_bgr, mask, method="blur", blur_ksize=151, mosaic_scale=0.06):
-    out = img_bgr.copy()
-    if mask.sum() == 0:
-        return out
-    if method == "pixelate":
-        ys, xs = np.where(mask == 1)
-        y1, y2 = ys.min(), ys.max() + 1
-        x1, x2 = xs.min(), xs.max() + 1
-        roi = out[y1:y2, x1:x2]
-        if roi.size > 0:
-            h, w = roi.shape[:2]
-            small = cv2.resize(roi, (max(1, int(w * mosaic_scale)), max(1, int(h * mosaic_scale))), interpolation=cv2.INTER_LINEAR)
-            pix = cv2.resize(small, (w, h), interpolation=cv2.INTER_NEAREST)
-            roi_mask = mask[y1:y2, x1:x2]
-            out[y1:y2, x1:x2][roi_mask == 1] = pix[roi_mask == 1]
-    else:  # blur
-        if blur_ksize % 2 == 0:
-            blur_ksize += 1
-        blurred = cv2.GaussianBlur(out, (blur_ksize, blur_ksize), 0)
-        out[mask == 1] = blurred[mask == 1]
-    return out
\ No newline at end of file
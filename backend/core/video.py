@@ -0,0 +1,173 @@
+# backend/core/video.py
+
+import queue
+import threading
+
+import cv2
+import numpy as np
+
+from core.boxes import clip_boxes, union_masks
+from core.imaging import redact
+
+# Frames are compared and tracked on a grayscale copy with this longer side
+TRACK_MAX_SIDE = 480
+
+
+def _small_gray(frame_bgr):
+    h, w = frame_bgr.shape[:2]
+    scale = min(1.0, TRACK_MAX_SIDE / float(max(h, w)))
+    small = cv2.resize(frame_bgr, (max(1, int(w * scale)), max(1, int(h * scale))), interpolation=cv2.INTER_AREA)
+    return cv2.cvtColor(small, cv2.COLOR_BGR2GRAY), scale
+
+
+class SceneChangeDetector:
+    """Flags a cut when the grayscale histogram moves too far from the previous frame's."""
+
+    def __init__(self, threshold=0.5):
+        self.threshold = threshold
+        self._prev_hist = None
+
+    def __call__(self, gray):
+        hist = cv2.calcHist([gray], [0], None, [64], [0, 256])
+        cv2.normalize(hist, hist)
+        changed = self._prev_hist is not None and \
+            cv2.compareHist(self._prev_hist, hist, cv2.HISTCMP_BHATTACHARYYA) > self.threshold
+        self._prev_hist = hist
+        return changed
+
+
+class BoxTracker:
+    """Moves boxes from one frame to the next with sparse Lucas-Kanade optical flow.
+
+    Each box is shifted by the median motion of the corner features found
+    inside it. Boxes whose features are all lost keep their last position, and
+    every box is grown by margin so small drift does not uncover the object.
+    """
+
+    def __init__(self, margin=0.1, max_corners=20):
+        self.margin = margin
+        self.max_corners = max_corners
+        self.boxes = np.empty((0, 4), dtype=float)  # in small-frame coordinates
+
+    def reset(self, boxes_small):
+        self.boxes = np.asarray(boxes_small, dtype=float).reshape(-1, 4)
+
+    def step(self, prev_gray, gray):
+        if len(self.boxes) == 0:
+            return self.boxes
+        h, w = gray.shape[:2]
+        moved = self.boxes.copy()
+        for i, (x1, y1, x2, y2) in enumerate(self.boxes.astype(int)):
+            x1, y1, x2, y2 = max(0, x1), max(0, y1), min(w, x2), min(h, y2)
+            if x2 - x1 < 2 or y2 - y1 < 2:
+                continue
+            roi_mask = np.zeros_like(prev_gray)
+            roi_mask[y1:y2, x1:x2] = 255
+            pts = cv2.goodFeaturesToTrack(prev_gray, self.max_corners, 0.01, 3, mask=roi_mask)
+            if pts is None:
+                continue
+            nxt, status, _ = cv2.calcOpticalFlowPyrLK(prev_gray, gray, pts, None, winSize=(15, 15), maxLevel=2)
+            ok = status.reshape(-1) == 1
+            if not ok.any():
+                continue
+            dx, dy = np.median((nxt - pts).reshape(-1, 2)[ok], axis=0)
+            moved[i] += [dx, dy, dx, dy]
+        self.boxes = moved
+        return moved
+
+    def padded(self):
+        b = self.boxes
+        pad_x = (b[:, 2] - b[:, 0]) * self.margin / 2
+        pad_y = (b[:, 3] - b[:, 1]) * self.margin / 2
+        return b + np.stack([-pad_x, -pad_y, pad_x, pad_y], axis=1)
+
+
+def _read_frames(cap, frames, stop):
+    while not stop.is_set():
+        ok, frame = cap.read()
+        frames.put(frame if ok else None)
+        if not ok:
+            return
+
+
+def _write_frames(writer, frames):
+    while True:
+        frame = frames.get()
+        if frame is None:
+            return
+        writer.write(frame)
+
+
+def redact_video(input_path, output_path, detect_fn, keyframe_interval=15, scene_threshold=0.5,
+                 method="blur", blur_ksize=151, mosaic_scale=0.06, track_margin=0.1, fourcc="mp4v",
+                 buffer_frames=8, progress=None):
+    """Redacts a video frame by frame without holding the clip in memory.
+
+    detect_fn(frame_bgr) returns full-resolution boxes and is only called on
+    keyframes: the first frame, every keyframe_interval frames, and any frame
+    where SceneChangeDetector sees a cut. In between, boxes are carried along
+    by BoxTracker. Decoding and encoding run on their own threads with at most
+    buffer_frames frames queued on each side. Audio is not copied.
+    Returns a dict of frame counts.
+    """
+    cap = cv2.VideoCapture(input_path)
+    if not cap.isOpened():
+        raise ValueError(f"Could not open video: {input_path}")
+    fps = cap.get(cv2.CAP_PROP_FPS) or 30.0
+    width = int(cap.get(cv2.CAP_PROP_FRAME_WIDTH))
+    height = int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT))
+    writer = cv2.VideoWriter(output_path, cv2.VideoWriter_fourcc(*fourcc), fps, (width, height))
+    if not writer.isOpened():
+        cap.release()
+        raise ValueError(f"Could not open video writer for: {output_path}")
+
+    read_q = queue.Queue(maxsize=buffer_frames)
+    write_q = queue.Queue(maxsize=buffer_frames)
+    stop = threading.Event()
+    reader = threading.Thread(target=_read_frames, args=(cap, read_q, stop), daemon=True)
+    writer_thread = threading.Thread(target=_write_frames, args=(writer, write_q), daemon=True)
+    reader.start()
+    writer_thread.start()
+
+    scene_change = SceneChangeDetector(scene_threshold)
+    tracker = BoxTracker(margin=track_margin)
+    stats = {"frames": 0, "keyframes": 0, "scene_changes": 0}
+    prev_gray, since_key = None, 0
+    try:
+        while True:
+            frame = read_q.get()
+            if frame is None:
+                break
+            gray, scale = _small_gray(frame)
+            cut = scene_change(gray)
+            if prev_gray is None or cut or since_key >= keyframe_interval:
+                boxes = np.asarray(detect_fn(frame), dtype=float).reshape(-1, 4)
+                tracker.reset(boxes * scale)
+                stats["keyframes"] += 1
+                stats["scene_changes"] += int(cut)
+                since_key = 0
+            else:
+                tracker.step(prev_gray, gray)
+            since_key += 1
+            prev_gray = gray
+            boxes = clip_boxes(tracker.padded() / scale, frame.shape)
+            mask = union_masks(frame.shape, [boxes])
+            # The writer thread still holds the previous frame, so each frame gets its own buffer
+            out = redact(frame, mask, method=method, blur_ksize=blur_ksize, mosaic_scale=mosaic_scale)
+            write_q.put(out)
+            stats["frames"] += 1
+            if progress is not None:
+                progress(stats)
+    finally:
+        stop.set()
+        # Unblock the reader if it is waiting on a full queue
+        while reader.is_alive():
+            try:
+                read_q.get_nowait()
+            except queue.Empty:
+                reader.join(timeout=0.05)
+        write_q.put(None)
+        writer_thread.join()
+        cap.release()
+        writer.release()
+    return stats
@@ -0,0 +1,76 @@
+# backend/core/workers.py
+
+import asyncio
+import contextlib
+import functools
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+
+class PoolSaturated(Exception):
+    """Raised by WorkerPool.admit when every worker is busy and the wait queue is full."""
+
+    def __init__(self, retry_after):
+        super().__init__(f"Server is busy, retry in {retry_after}s")
+        self.retry_after = retry_after
+
+
+class WorkerPool:
+    """Bounded thread pool for the blocking model and OpenCV stages.
+
+    At most ``max_workers`` stages run at once. Requests enter through
+    ``admit()``, which lets in up to ``max_workers + max_pending`` requests and
+    raises PoolSaturated for the rest, so overload turns into a fast rejection
+    instead of an ever-growing backlog in memory.
+
+    ``on_wait``, if given, is called from the worker thread with the seconds
+    each ``run()`` call spent queued before a worker picked it up.
+    """
+
+    def __init__(self, max_workers=2, max_pending=8, retry_after=1, on_wait=None):
+        self.max_workers = max_workers
+        self.max_pending = max_pending
+        self.retry_after = retry_after
+        self.on_wait = on_wait
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="inference")
+        self._admitted = 0
+        self._rejected = 0
+
+    @property
+    def capacity(self):
+        return self.max_workers + self.max_pending
+
+    @contextlib.asynccontextmanager
+    async def admit(self):
+        # Only touched from the event loop thread, so a plain counter is enough
+        if self._admitted >= self.capacity:
+            self._rejected += 1
+            raise PoolSaturated(self.retry_after)
+        self._admitted += 1
+        try:
+            yield
+        finally:
+            self._admitted -= 1
+
+    async def run(self, fn, *args, **kwargs):
+        loop = asyncio.get_running_loop()
+        call = functools.partial(fn, *args, **kwargs)
+        if self.on_wait is None:
+            return await loop.run_in_executor(self.executor, call)
+        submitted = time.perf_counter()
+
+        def timed_call():
+            self.on_wait(time.perf_counter() - submitted)
+            return call()
+        return await loop.run_in_executor(self.executor, timed_call)
+
+    def shutdown(self):
+        self.executor.shutdown(wait=False, cancel_futures=True)
+
+    def metrics(self):
+        return {
+            "max_workers": self.max_workers,
+            "max_pending": self.max_pending,
+            "admitted": self._admitted,
+            "rejected": self._rejected,
+        }
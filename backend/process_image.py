@@ -4,37 +4,74 @@ import argparse
 import base64
 import numpy as np
 import cv2
-import io
 import os
-import torch
-from PIL import Image
+import glob
+import time
+import queue
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 
-# Import all core functions from the redactor.py file
-from core.redactor import (
-    load_image, load_gdino, detect_gdino, try_ocr, detect_ocr_boxes,
-    union_masks, redact
-)
+# Models and detection come from the shared pipeline in core/pipeline.py
+from core.backends import BACKENDS
+from core import ingest
+from core.pipeline import RedactionPipeline, DEFAULT_QUERIES
+from core.redactor import KEEP_LABEL_KEYWORDS
+
+IMAGE_EXTENSIONS = {".jpg", ".jpeg", ".png", ".webp", ".bmp", ".tif", ".tiff"}
 
 def main():
-    try:
-        # Use argparse to handle command-line arguments correctly
-        parser = argparse.ArgumentParser(description="Process and redact an image.")
-        parser.add_argument("--method", type=str, default="blur", help="Redaction method (blur or pixelate)")
-        parser.add_argument("--blur_ksize", type=int, default=151, help="Kernel size for blur method")
-        parser.add_argument("--mosaic_scale", type=float, default=0.06, help="Scale for pixelate method")
-        parser.add_argument("--debug", action="store_true", help="Save intermediate images for debugging.")
-        args = parser.parse_args()
+    # Use argparse to handle command-line arguments correctly
+    parser = argparse.ArgumentParser(description="Process and redact an image, or a whole batch of them.")
+    parser.add_argument("inputs", nargs="*",
+                        help="Batch mode: image files, directories, glob patterns, or .txt/.jsonl manifests. "
+                             "With no inputs, one image is read from stdin.")
+    parser.add_argument("--method", type=str, default="blur", help="Redaction method (blur or pixelate)")
+    parser.add_argument("--blur_ksize", type=int, default=151, help="Kernel size for blur method")
+    parser.add_argument("--mosaic_scale", type=float, default=0.06, help="Scale for pixelate method")
+    parser.add_argument("--debug", action="store_true", help="Save intermediate images for debugging.")
+    parser.add_argument("--output-dir", default="redacted", help="Batch mode: where redacted images are written")
+    parser.add_argument("--results", default=None,
+                        help="Batch mode: JSONL file of boxes and timings (default: <output-dir>/results.jsonl)")
+    parser.add_argument("--resume", action="store_true",
+                        help="Batch mode: skip inputs already recorded as done in the results file")
+    parser.add_argument("--batch-size", type=int, default=4, help="Batch mode: images per Grounding DINO forward pass")
+    parser.add_argument("--prefetch", type=int, default=8, help="Batch mode: images decoded ahead of the detector")
+    parser.add_argument("--io-workers", type=int, default=4, help="Batch mode: threads for decoding and writing")
+    parser.add_argument("--detect-max-side", type=int, default=1333,
+                        help="Longest side of the copy the detectors see (0 = full resolution)")
+    parser.add_argument("--quality", type=int, default=90, help="JPEG quality of the outputs")
+    parser.add_argument("--backend", default="eager", choices=BACKENDS,
+                        help="Grounding DINO inference backend (int8 and onnx are the fast ones on CPU)")
+    parser.add_argument("--onnx-path", default="gdino.onnx", help="Exported graph for --backend onnx")
+    args = parser.parse_args()
+    for name in ("batch_size", "prefetch", "io_workers"):
+        if getattr(args, name) < 1:
+            parser.error(f"--{name.replace('_', '-')} must be at least 1")
+    if args.inputs:
+        run_batch(args)
+    else:
+        run_stdin(args)
 
+def make_pipeline(args, **kwargs):
+    # The CLI only redacts: no GeoCLIP, and Grounding DINO labels and small OCR boxes are filtered
+    return RedactionPipeline(backend=args.backend, onnx_path=args.onnx_path, keep_labels=KEEP_LABEL_KEYWORDS,
+                             detect_max_side=args.detect_max_side, use_geoclip=False, ocr_min_area=4000,
+                             ocr_merge=True, **kwargs)
+
+def run_stdin(args):
+    try:
         # Log start of process
         print("Starting image processing...", file=sys.stderr)
         
         # Read the image data from stdin (sent from FastAPI)
         image_bytes = sys.stdin.buffer.read()
-        image_stream = io.BytesIO(image_bytes)
-        
-        # Decode the image using OpenCV
-        image_np = np.frombuffer(image_stream.read(), np.uint8)
-        img_bgr = cv2.imdecode(image_np, cv2.IMREAD_COLOR)
+
+        # Decode the image using OpenCV, upright according to its EXIF orientation
+        try:
+            img_bgr = ingest.load_image(image_bytes)
+        except ValueError:
+            img_bgr = None
 
         if img_bgr is None:
             # Handle the case where the image data is invalid
@@ -53,43 +90,31 @@ def main():
             cv2.imwrite(os.path.join(debug_dir, "step1_original.jpg"), img_bgr)
             print(f"Saved original image to {debug_dir}/step1_original.jpg", file=sys.stderr)
 
-        # Convert the image to PIL format for Grounding DINO
-        img_pil = Image.fromarray(cv2.cvtColor(img_bgr, cv2.COLOR_BGR2RGB))
-        
         # Load and run models
         print("Loading Grounding DINO and OCR models...", file=sys.stderr)
-        device = "cuda" if torch.cuda.is_available() else "cpu"
-        processor, model = load_gdino(device)
-        ocr = try_ocr()
+        pipeline = make_pipeline(args).load()
         print("Models loaded successfully.", file=sys.stderr)
         
         # Detect objects and text
         print("Starting object and text detection...", file=sys.stderr)
-        queries = ["street name sign", "road name sign", "flag", "landmark", "monument", "person", "child"]
-        boxes_gd, _, _ = detect_gdino(img_pil, processor, model, device, 0.25, 0.20, queries)
-        boxes_ocr = detect_ocr_boxes(img_bgr, ocr) if ocr else np.empty((0, 4), dtype=int)
+        box_lists = pipeline.detect(img_bgr, DEFAULT_QUERIES)["boxes"]
         print("Detection complete.", file=sys.stderr)
 
         # Debugging: Save image with detections
         if args.debug:
             img_with_boxes = img_bgr.copy()
-            for box in boxes_gd:
-                x1, y1, x2, y2 = box
-                cv2.rectangle(img_with_boxes, (x1, y1), (x2, y2), (0, 255, 0), 2)
-            for box in boxes_ocr:
-                x1, y1, x2, y2 = box
-                cv2.rectangle(img_with_boxes, (x1, y1), (x2, y2), (255, 0, 0), 2)
+            # Grounding DINO in green, OCR in blue, faces in red
+            for boxes, color in zip(box_lists, [(0, 255, 0), (255, 0, 0), (0, 0, 255)]):
+                for x1, y1, x2, y2 in boxes.tolist():
+                    cv2.rectangle(img_with_boxes, (x1, y1), (x2, y2), color, 2)
             cv2.imwrite(os.path.join(debug_dir, "step2_detections.jpg"), img_with_boxes)
             print(f"Saved image with detections to {debug_dir}/step2_detections.jpg", file=sys.stderr)
         
-        # Combine the detection masks
+        # Combine the detection masks and redact the image
         print("Combining masks and redacting image...", file=sys.stderr)
-        mask = union_masks(img_bgr.shape, [boxes_gd, boxes_ocr])
-        
-        # Redact the image
-        redacted_image = redact(
+        redacted_image = pipeline.redact_image(
             img_bgr,
-            mask,
+            box_lists,
             method=args.method,
             blur_ksize=args.blur_ksize,
             mosaic_scale=args.mosaic_scale
@@ -102,8 +127,8 @@ def main():
             print(f"Saved redacted image to {debug_dir}/step3_redacted.jpg", file=sys.stderr)
         
         # Encode the redacted image back to bytes in JPEG format
-        _, img_encoded = cv2.imencode('.jpeg', redacted_image)
-        redacted_image_base64 = base64.b64encode(img_encoded.tobytes()).decode('utf-8')
+        img_encoded = pipeline.encode(redacted_image, "jpeg", args.quality)
+        redacted_image_base64 = base64.b64encode(img_encoded).decode('utf-8')
 
         # Create a JSON response
         response = {
@@ -121,5 +146,198 @@ def main():
         sys.stdout.flush()
         sys.exit(1)
 
+def output_name(rel_path):
+    # Outputs are always JPEG; any other extension stays in the name so y.png and y.jpg do not clash
+    stem, ext = os.path.splitext(rel_path)
+    return stem + ".jpg" if ext == ".jpg" else rel_path + ".jpg"
+
+def expand_inputs(specs):
+    """Resolves files, directories, globs and manifests into (path, output_name) pairs.
+
+    Output names keep the path relative to the directory, glob root or
+    manifest entries' common folder they came from, plus the original
+    extension. Raises ValueError if two inputs would still be written to the
+    same output file, since one would silently overwrite the other.
+    """
+    pairs = []
+    for spec in specs:
+        if os.path.isdir(spec):
+            for root, _, files in os.walk(spec):
+                for name in sorted(files):
+                    if os.path.splitext(name)[1].lower() in IMAGE_EXTENSIONS:
+                        path = os.path.join(root, name)
+                        pairs.append((path, os.path.relpath(path, spec)))
+        elif spec.endswith((".txt", ".jsonl")) and os.path.isfile(spec):
+            paths = []
+            with open(spec) as f:
+                for line in f:
+                    line = line.strip()
+                    if not line:
+                        continue
+                    paths.append(json.loads(line)["path"] if spec.endswith(".jsonl") else line)
+            if paths:
+                root = os.path.commonpath([os.path.dirname(os.path.abspath(p)) for p in paths])
+                pairs.extend((p, os.path.relpath(os.path.abspath(p), root)) for p in paths)
+        elif glob.has_magic(spec):
+            root = spec.split("*")[0].split("?")[0].split("[")[0]
+            root = root if os.path.isdir(root) else os.path.dirname(root)
+            for path in sorted(glob.glob(spec, recursive=True)):
+                if os.path.isfile(path):
+                    pairs.append((path, os.path.relpath(path, root or ".")))
+        else:
+            pairs.append((spec, os.path.basename(spec)))
+    pairs = [(path, output_name(rel)) for path, rel in dict.fromkeys(pairs)]
+    claimed = {}
+    for path, out_name in pairs:
+        other = claimed.setdefault(os.path.normcase(os.path.normpath(out_name)), path)
+        if other != path:
+            raise ValueError(f"{other} and {path} would both be written to {out_name}; "
+                             "pass them in separate runs or with different --output-dir")
+    return pairs
+
+def load_done(results_path):
+    # Inputs with an "ok" record from an earlier (possibly interrupted) run
+    done = set()
+    if os.path.isfile(results_path):
+        with open(results_path) as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except json.JSONDecodeError:
+                    continue  # a line cut short by the interruption
+                if record.get("status") == "ok":
+                    done.add(record["input"])
+    return done
+
+def decode_job(path, pipeline):
+    start = time.perf_counter()
+    with open(path, "rb") as f:
+        image_bytes = f.read()
+    try:
+        img_bgr = ingest.load_image(image_bytes, pipeline.max_pixels)
+    except ingest.ImageRejected:
+        raise
+    except ValueError:
+        raise ValueError(f"Could not decode image: {path}")
+    return img_bgr, (time.perf_counter() - start) * 1000
+
+def write_job(job, args, pipeline, results_file, results_lock):
+    path, out_name, img_bgr, detection, timings = job
+    boxes_gd, boxes_ocr, _ = detection["boxes"]
+    start = time.perf_counter()
+    redacted = pipeline.redact_image(img_bgr, detection["boxes"], method=args.method, blur_ksize=args.blur_ksize,
+                                     mosaic_scale=args.mosaic_scale)
+    encoded = pipeline.encode(redacted, "jpeg", args.quality)
+    timings["redact_encode_ms"] = (time.perf_counter() - start) * 1000
+    out_path = os.path.join(args.output_dir, out_name)
+    os.makedirs(os.path.dirname(out_path) or ".", exist_ok=True)
+    # Write to a temp name first so an interruption never leaves a truncated output behind
+    tmp_path = out_path + ".part"
+    with open(tmp_path, "wb") as f:
+        f.write(encoded)
+    os.replace(tmp_path, out_path)
+    record = {
+        "input": path, "output": out_path, "status": "ok",
+        "boxes_gdino": np.asarray(boxes_gd).tolist(), "boxes_ocr": np.asarray(boxes_ocr).tolist(),
+        "timings_ms": {k: round(v, 2) for k, v in timings.items()},
+    }
+    write_record(record, results_file, results_lock)
+
+def write_record(record, results_file, results_lock):
+    with results_lock:
+        results_file.write(json.dumps(record) + "\n")
+        results_file.flush()
+
+def run_batch(args):
+    """Redacts many images with one set of loaded models.
+
+    Decoding runs ahead of the detector on a thread pool (up to --prefetch
+    images), Grounding DINO sees --batch-size images per forward pass, and
+    masking, redaction, encoding and writing happen on the same pool while
+    the next batch is being detected. Each finished image is appended to the
+    results JSONL, which is what --resume reads back.
+    """
+    os.makedirs(args.output_dir, exist_ok=True)
+    results_path = args.results or os.path.join(args.output_dir, "results.jsonl")
+    try:
+        pairs = expand_inputs(args.inputs)
+    except ValueError as e:
+        sys.exit(str(e))
+    if args.resume:
+        done = load_done(results_path)
+        pairs = [(p, o) for p, o in pairs if p not in done]
+        print(f"Resuming: {len(done)} already done, {len(pairs)} to go.", file=sys.stderr)
+    if not pairs:
+        print("Nothing to process.", file=sys.stderr)
+        return
+
+    print("Loading Grounding DINO and OCR models...", file=sys.stderr)
+    pipeline = make_pipeline(args, max_batch=args.batch_size).load()
+    print("Models loaded successfully.", file=sys.stderr)
+
+    results_lock = threading.Lock()
+    pending_writes = deque()
+    start_all = time.perf_counter()
+    ok_count = err_count = 0
+    with open(results_path, "a") as results_file, ThreadPoolExecutor(max_workers=args.io_workers) as pool:
+        def record_error(path, e):
+            nonlocal err_count
+            err_count += 1
+            print(f"Failed on {path}: {e}", file=sys.stderr)
+            write_record({"input": path, "status": "error", "error": str(e)}, results_file, results_lock)
+
+        # Producer: keep up to --prefetch decodes in flight, in input order
+        decoded = queue.Queue(maxsize=max(1, args.prefetch))
+        def produce():
+            for path, out_name in pairs:
+                decoded.put((path, out_name, pool.submit(decode_job, path, pipeline)))
+            decoded.put(None)
+        threading.Thread(target=produce, daemon=True).start()
+
+        def flush_writes(block_until=0):
+            # Collect finished writes; block while more than block_until are outstanding
+            nonlocal ok_count
+            while len(pending_writes) > block_until:
+                path, fut = pending_writes.popleft()
+                try:
+                    fut.result()
+                    ok_count += 1
+                except Exception as e:
+                    record_error(path, e)
+
+        finished = False
+        while not finished:
+            batch = []
+            while len(batch) < args.batch_size:
+                item = decoded.get()
+                if item is None:
+                    finished = True
+                    break
+                path, out_name, fut = item
+                try:
+                    batch.append((path, out_name) + fut.result())
+                except Exception as e:
+                    record_error(path, e)
+            if not batch:
+                continue
+            start = time.perf_counter()
+            try:
+                detections = pipeline.detect_batch([b[2] for b in batch], DEFAULT_QUERIES)
+            except Exception as e:
+                for b in batch:
+                    record_error(b[0], e)
+                continue
+            detect_ms = (time.perf_counter() - start) * 1000 / len(batch)
+            for (path, out_name, img_bgr, decode_ms), detection in zip(batch, detections):
+                timings = {"decode_ms": decode_ms, "detect_ms": detect_ms}
+                flush_writes(block_until=args.prefetch - 1)
+                job = (path, out_name, img_bgr, detection, timings)
+                pending_writes.append((path, pool.submit(write_job, job, args, pipeline, results_file, results_lock)))
+        flush_writes()
+
+    elapsed = time.perf_counter() - start_all
+    print(f"Done: {ok_count} redacted, {err_count} failed in {elapsed:.1f}s "
+          f"({ok_count / elapsed if elapsed else 0:.2f} img/s). Results in {results_path}", file=sys.stderr)
+
 if __name__ == "__main__":
     main()
@@ -0,0 +1,49 @@
+import sys
+import json
+import argparse
+import numpy as np
+
+from core.pipeline import RedactionPipeline, DEFAULT_QUERIES
+from core.redactor import KEEP_LABEL_KEYWORDS
+from core.video import redact_video
+
+def main():
+    parser = argparse.ArgumentParser(description="Redact a video clip, detecting on keyframes and tracking in between.")
+    parser.add_argument("input", help="Input video file")
+    parser.add_argument("output", help="Output video file (.mp4); audio is not copied")
+    parser.add_argument("--method", type=str, default="blur", help="Redaction method (blur or pixelate)")
+    parser.add_argument("--blur_ksize", type=int, default=151, help="Kernel size for blur method")
+    parser.add_argument("--mosaic_scale", type=float, default=0.06, help="Scale for pixelate method")
+    parser.add_argument("--keyframe-interval", type=int, default=15,
+                        help="Run the detectors at least every N frames (scene cuts also trigger detection)")
+    parser.add_argument("--scene-threshold", type=float, default=0.5,
+                        help="Histogram distance (0-1) above which a frame counts as a scene cut")
+    parser.add_argument("--track-margin", type=float, default=0.1,
+                        help="Fraction by which tracked boxes are grown to absorb drift")
+    parser.add_argument("--detect-max-side", type=int, default=1333,
+                        help="Longest side of the copy the detectors see (0 = full resolution)")
+    args = parser.parse_args()
+
+    print("Loading Grounding DINO and OCR models...", file=sys.stderr)
+    pipeline = RedactionPipeline(keep_labels=KEEP_LABEL_KEYWORDS, detect_max_side=args.detect_max_side,
+                                 use_geoclip=False, ocr_min_area=4000, ocr_merge=True).load()
+    print("Models loaded successfully.", file=sys.stderr)
+
+    def detect(frame_bgr):
+        return np.concatenate([b.reshape(-1, 4) for b in pipeline.detect(frame_bgr, DEFAULT_QUERIES)["boxes"]])
+
+    def progress(stats):
+        if stats["frames"] % 30 == 0:
+            print(f"{stats['frames']} frames, {stats['keyframes']} keyframes", file=sys.stderr)
+
+    stats = redact_video(
+        args.input, args.output, detect,
+        keyframe_interval=args.keyframe_interval, scene_threshold=args.scene_threshold,
+        method=args.method, blur_ksize=args.blur_ksize, mosaic_scale=args.mosaic_scale,
+        track_margin=args.track_margin, progress=progress,
+    )
+    json.dump(stats, sys.stdout)
+    sys.stdout.write("\n")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,155 @@
+# backend/serve.py
+#
+# Multi-process serving for big CPU (or multi-GPU) nodes. Instead of one uvicorn
+# process holding every model:
+#
+#   - N thin HTTP front processes share one listening socket. They decode,
+#     redact and encode, but hold no models.
+#   - M model-worker processes each load GeoCLIP, Grounding DINO and OCR once
+#     and are pinned to their own block of cores (or to a GPU).
+#   - Fronts copy the detection-sized frame into shared memory and send only
+#     its name over a queue; any idle worker picks the job up.
+#
+# With --preload (CPU only) the supervisor loads the weights once before forking
+# the workers, so they share those pages copy-on-write instead of holding M copies.
+#
+# Run from backend/:
+#   python serve.py --fronts 4 --model-workers 4            # 32 cores: 4 x 7 for models, 4 for fronts
+#   python serve.py --fronts 2 --devices cuda:0 cuda:1
+
+import argparse
+import logging
+import multiprocessing as mp
+import os
+import signal
+import socket
+import time
+
+from core.metrics import setup_logging
+from core.procpool import ModelClient, core_sets, worker_main
+
+log = logging.getLogger("geosafe.serve")
+
+
+def run_front(index, sock, tasks, results, ready, n_workers, cores, log_level, call_timeout):
+    if cores:
+        os.sched_setaffinity(0, cores)
+    import uvicorn
+    import server
+    client = ModelClient(index, tasks, results[index], ready, n_workers,
+                         n_slots=server.inference_pool.capacity,
+                         slot_bytes=server.DETECT_MAX_SIDE ** 2 * 3 if server.DETECT_MAX_SIDE > 0 else 0,
+                         timeout=call_timeout)
+    server.use_model_client(client)
+    config = uvicorn.Config(server.app, log_level=log_level.lower(), timeout_keep_alive=5)
+    uvicorn.Server(config).run(sockets=[sock])
+
+
+def main():
+    cpus = len(os.sched_getaffinity(0))
+    parser = argparse.ArgumentParser(description="Serve the redaction API with separate front and model-worker processes.")
+    parser.add_argument("--host", default="0.0.0.0")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--fronts", type=int, default=max(1, cpus // 8), help="HTTP front processes")
+    parser.add_argument("--model-workers", type=int, default=max(1, cpus // 8), help="Model-worker processes")
+    parser.add_argument("--worker-cores", type=int, default=0,
+                        help="Cores pinned to each model worker (0 = split what the fronts leave evenly)")
+    parser.add_argument("--devices", nargs="*", default=[],
+                        help="Torch devices handed to model workers round-robin, e.g. cuda:0 cuda:1 (default: CPU)")
+    parser.add_argument("--preload", action="store_true",
+                        help="Load weights once in the supervisor and fork workers that share them (CPU only)")
+    parser.add_argument("--call-timeout", type=float, default=120.0, help="Seconds a front waits on a model worker")
+    args = parser.parse_args()
+
+    log_level = os.environ.get("LOG_LEVEL", "INFO")
+    setup_logging(log_level)
+
+    use_gpu = any(d.startswith("cuda") for d in args.devices)
+    if use_gpu and args.preload:
+        parser.error("--preload only works on CPU: CUDA cannot be initialised before fork")
+    # CUDA needs spawned workers; on CPU fork is faster to start and allows --preload
+    ctx = mp.get_context("spawn" if use_gpu else "fork")
+
+    if use_gpu:
+        worker_cores, front_cores = [[] for _ in range(args.model_workers)], []
+    else:
+        per_worker = args.worker_cores or max(1, (cpus - args.fronts) // args.model_workers)
+        worker_cores, front_cores = core_sets(args.model_workers, per_worker)
+    devices = [args.devices[i % len(args.devices)] if args.devices else None for i in range(args.model_workers)]
+
+    sock = socket.socket(socket.AF_INET6 if ":" in args.host else socket.AF_INET)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind((args.host, args.port))
+    sock.listen(2048)
+    sock.set_inheritable(True)
+
+    tasks = ctx.Queue()
+    results = [ctx.Queue() for _ in range(args.fronts)]
+    ready = ctx.Array("b", args.model_workers)
+    max_batch = int(os.environ.get("GDINO_MAX_BATCH", "8"))
+    # Each front has one shared-memory slot per inference pool place (see run_front)
+    slots_per_front = (int(os.environ.get("INFERENCE_WORKERS", "3"))
+                       + int(os.environ.get("INFERENCE_MAX_PENDING", "8")))
+
+    def start_front(i):
+        p = ctx.Process(target=run_front, name=f"front-{i}", daemon=True,
+                        args=(i, sock, tasks, results, ready, args.model_workers, front_cores, log_level,
+                              args.call_timeout))
+        p.start()
+        return p
+
+    def start_worker(i):
+        p = ctx.Process(target=worker_main, name=f"model-worker-{i}", daemon=True,
+                        args=(i, "server:model_worker_ops", {}, worker_cores[i], devices[i], tasks, results,
+                              ready, max_batch, args.fronts * slots_per_front))
+        p.start()
+        return p
+
+    # Fronts are forked before any weights are loaded here, so they stay small
+    procs = {("front", i): start_front(i) for i in range(args.fronts)}
+    if args.preload:
+        import torch
+        import server
+        # A single intra-op thread keeps OpenMP from starting a thread pool that
+        # forked children would inherit in a broken state
+        torch.set_num_threads(1)
+        server.preload_weights()
+    procs.update({("worker", i): start_worker(i) for i in range(args.model_workers)})
+    log.info("Serving on %s:%d with %d fronts (cores %s) and %d model workers (%s)", args.host, args.port,
+             args.fronts, front_cores or "any", args.model_workers,
+             ", ".join(str(d or c) for d, c in zip(devices, worker_cores)))
+
+    stopping = False
+
+    def stop(signum, frame):
+        nonlocal stopping
+        stopping = True
+
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+    while not stopping:
+        time.sleep(1.0)
+        for (kind, i), p in list(procs.items()):
+            if p.is_alive() or stopping:
+                continue
+            log.warning("%s exited with code %s; restarting it", p.name, p.exitcode)
+            if kind == "worker":
+                ready[i] = 0
+                procs[kind, i] = start_worker(i)
+            else:
+                procs[kind, i] = start_front(i)
+
+    log.info("Shutting down")
+    for (kind, _), p in procs.items():
+        if kind == "front":
+            p.terminate()  # uvicorn shuts down gracefully on SIGTERM
+    for _ in range(args.model_workers):
+        tasks.put(None)
+    for p in procs.values():
+        p.join(timeout=30)
+        if p.is_alive():
+            p.kill()
+
+
+if __name__ == "__main__":
+    main()
@@ -1,205 +1,531 @@
-import io
-import cv2
+import asyncio
 import base64
-import numpy as np
-import torch
-from PIL import Image
-from fastapi import FastAPI, UploadFile, File, Form, HTTPException, Request
-from fastapi.responses import JSONResponse
+import contextlib
+import functools
+from fastapi import FastAPI, UploadFile, File, Form, Header, HTTPException, Request
+from fastapi.responses import JSONResponse, Response, PlainTextResponse, StreamingResponse
 from pydantic import BaseModel
 from typing import Dict, Any, Optional
-import sys
-from transformers import AutoProcessor, AutoModelForZeroShotObjectDetection
-from geoclip import GeoCLIP
-import tempfile
+import os
+import logging
+import time
+from core.workers import WorkerPool, PoolSaturated
+from core.cache import DetectionCache, detection_key
+from core.jobs import JobStore, IdempotencyConflict
+from core.metrics import Registry, setup_logging, stop_logging
+from core.pipeline import RedactionPipeline, IMAGE_FORMATS, parse_routes
+from core import ingest
 import json
 
 
-# Core functions from redactor.py, combined here for a single-file backend
-def load_image(image_bytes):
-    try:
-        image_stream = io.BytesIO(image_bytes)
-        image_np = np.frombuffer(image_stream.read(), np.uint8)
-        img_bgr = cv2.imdecode(image_np, cv2.IMREAD_COLOR)
-        if img_bgr is None:
-            raise ValueError("Could not decode image from input.")
-        return img_bgr
-    except Exception as e:
-        raise ValueError(f"Error loading image: {e}")
-
-def load_gdino(device: str = "cpu"):
-    print("Loading Grounding DINO model...", file=sys.stderr)
-    model_id = "IDEA-Research/grounding-dino-base"
-    processor = AutoProcessor.from_pretrained(model_id)
-    model = AutoModelForZeroShotObjectDetection.from_pretrained(model_id).to(device)
-    print("Grounding DINO model loaded.", file=sys.stderr)
-    return processor, model
-
-def detect_gdino(img_pil, processor, model, device, box_threshold, text_threshold, queries):
-    # The new model requires text queries to be a single string, lowercase, and end with a period.
-    text = ". ".join([q.lower() for q in queries]) + "."
-    inputs = processor(images=img_pil, text=text, return_tensors="pt").to(device)
-    
-    with torch.no_grad():
-        outputs = model(**inputs)
-    
-    results = processor.post_process_grounded_object_detection(
-        outputs,
-        inputs.input_ids,
-        box_threshold=box_threshold,
-        text_threshold=text_threshold,
-        target_sizes=[img_pil.size[::-1]]
-    )
-    
-    boxes = results[0]["boxes"].cpu().numpy()
-    labels = results[0]["labels"]
-    #phrases = results[0]["phrases"]
-
-    return boxes, labels
-
-def try_ocr():
-    try:
-        from paddleocr import PaddleOCR
-        print("Loading PaddleOCR...", file=sys.stderr)
-        ocr = PaddleOCR(use_angle_cls=True, lang="en", show_log=False)
-        print("PaddleOCR loaded.", file=sys.stderr)
-        return ocr
-    except ImportError:
-        print("PaddleOCR not found. Skipping OCR detection.", file=sys.stderr)
-        return None
-    except Exception as e:
-        print(f"Error loading PaddleOCR: {e}. Skipping OCR detection.", file=sys.stderr)
-        return None
-
-def detect_ocr_boxes(image_bgr, ocr):
-    results = ocr.ocr(image_bgr, cls=True)
-    boxes = []
-    if results and results[0]:
-        for line in results[0]:
-            points = line[0]
-            if points:
-                x_coords = [p[0] for p in points]
-                y_coords = [p[1] for p in points]
-                x_min, x_max = min(x_coords), max(x_coords)
-                y_min, y_max = min(y_coords), max(y_coords)
-                boxes.append([x_min, y_min, x_max, y_max])
-    return np.array(boxes)
-
-def union_masks(image_shape, box_lists):
-    mask = np.zeros((image_shape[0], image_shape[1]), dtype=np.uint8)
-    for boxes in box_lists:
-        if boxes is not None and len(boxes) > 0:
-            for box in boxes:
-                x_min, y_min, x_max, y_max = [int(v) for v in box]
-                mask[y_min:y_max, x_min:x_max] = 255
-    return mask
-
-def redact(image, mask, method="blur", blur_ksize=151, mosaic_scale=0.06):
-    if method == "blur":
-        # Ensure ksize is odd
-        if blur_ksize % 2 == 0:
-            blur_ksize += 1
-        blurred = cv2.GaussianBlur(image, (blur_ksize, blur_ksize), 0)
-        return np.where(mask[:, :, None] == 255, blurred, image)
-    elif method == "pixelate":
-        h, w = image.shape[:2]
-        small_h = int(h * mosaic_scale)
-        small_w = int(w * mosaic_scale)
-        if small_h <= 0: small_h = 1
-        if small_w <= 0: small_w = 1
-        
-        resized = cv2.resize(image, (small_w, small_h), interpolation=cv2.INTER_LINEAR)
-        pixelated = cv2.resize(resized, (w, h), interpolation=cv2.INTER_NEAREST)
-        return np.where(mask[:, :, None] == 255, pixelated, image)
-    return image
-
 # Initialize the FastAPI app
 app = FastAPI()
 
-# Global variables for models
-device = "cuda" if torch.cuda.is_available() else "cpu"
-processor, gdino_model = None, None
-ocr_model = None
-models_loaded = False
+# Log records go through a queue to a background thread, so handlers never block
+# on stderr. LOG_LEVEL=DEBUG also logs each request's queries and predictions.
+LOG_LEVEL = os.environ.get("LOG_LEVEL", "INFO")
+setup_logging(LOG_LEVEL)
+log = logging.getLogger("geosafe.server")
+
+# Prometheus metrics, served as text on /metrics
+metrics = Registry()
+STAGE_SECONDS = metrics.histogram(
+    "geosafe_stage_seconds", "Time spent running each pipeline stage, excluding queueing.", ["stage"])
+QUEUE_WAIT_SECONDS = metrics.histogram(
+    "geosafe_queue_wait_seconds", "Time work waited for a worker thread or a Grounding DINO batch.", ["queue"])
+REQUEST_SECONDS = metrics.histogram(
+    "geosafe_request_seconds", "End-to-end request latency.", ["endpoint", "cache"])
+REQUESTS = metrics.counter("geosafe_requests_total", "Requests by endpoint and HTTP status.", ["endpoint", "status"])
+MODEL_LOAD_SECONDS = metrics.gauge("geosafe_model_load_seconds", "Time taken to load and set up each model.", ["model"])
+
+# Blocking model and OpenCV stages run on a bounded pool so they never stall the
+# event loop. At most INFERENCE_WORKERS stages run at once and at most
+# INFERENCE_MAX_PENDING further requests wait; the rest get a 503 with Retry-After.
+INFERENCE_WORKERS = int(os.environ.get("INFERENCE_WORKERS", "3"))
+INFERENCE_MAX_PENDING = int(os.environ.get("INFERENCE_MAX_PENDING", "8"))
+RETRY_AFTER_SECONDS = int(os.environ.get("RETRY_AFTER_SECONDS", "2"))
+inference_pool = WorkerPool(INFERENCE_WORKERS, INFERENCE_MAX_PENDING, RETRY_AFTER_SECONDS,
+                            on_wait=lambda s: QUEUE_WAIT_SECONDS.observe(s, queue="inference_pool"))
+
+# Requests whose Content-Length is over MAX_IMAGE_MB (plus room for the other form
+# fields) are refused before the multipart body is read; Starlette spools the whole
+# body before a handler runs, so this is the only check that saves reading it. A
+# chunked upload without Content-Length is still spooled, then refused when the image
+# part is read. Images over MAX_IMAGE_MEGAPIXELS are refused from their header before
+# anything is decoded. All of these answer 413.
+MAX_IMAGE_BYTES = int(float(os.environ.get("MAX_IMAGE_MB", "40")) * 1024 * 1024)
+MAX_IMAGE_PIXELS = int(float(os.environ.get("MAX_IMAGE_MEGAPIXELS", "100")) * 1_000_000)
+MAX_FORM_OVERHEAD_BYTES = 1024 * 1024
+
+@app.middleware("http")
+async def limit_body_size(request: Request, call_next):
+    length = request.headers.get("content-length", "")
+    if length.isdigit() and int(length) > MAX_IMAGE_BYTES + MAX_FORM_OVERHEAD_BYTES:
+        return JSONResponse(content={"detail": f"Image is larger than {MAX_IMAGE_BYTES} bytes."}, status_code=413)
+    return await call_next(request)
+
+# Detectors run on a copy whose longer side is at most DETECT_MAX_SIDE pixels (0 = full
+# resolution); only the final redaction touches the full-resolution image.
+DETECT_MAX_SIDE = int(os.environ.get("DETECT_MAX_SIDE", "1333"))
+
+# Detection results (boxes + GeoCLIP prediction, plus the upload for re-rendering) are
+# cached by image hash and query set, so re-submitting the same photo with new
+# redaction settings skips the models.
+CACHE_MAX_ENTRIES = int(os.environ.get("CACHE_MAX_ENTRIES", "128"))
+CACHE_MAX_MB = int(os.environ.get("CACHE_MAX_MB", "256"))
+CACHE_TTL_SECONDS = float(os.environ.get("CACHE_TTL_SECONDS", "900"))
+detection_cache = DetectionCache(CACHE_MAX_ENTRIES, CACHE_MAX_MB * 1024 * 1024, CACHE_TTL_SECONDS)
+
+# Every redaction runs as a job. POST /jobs answers with a job id straight away; GET
+# /jobs/{id} (long-polling with ?wait=) or the /jobs/{id}/events SSE stream report
+# progress, and GET /jobs/{id}/result returns the image. /process_image submits a job
+# and waits for it. An Idempotency-Key header on either makes a retry attach to the
+# job already running instead of running the models again. Finished jobs are kept
+# for JOB_TTL_SECONDS, at most JOBS_MAX_ENTRIES of them. The store lives in this
+# process: behind serve.py with several fronts, a poll that lands on another front
+# gets a 404, so clients there should follow the event stream instead.
+JOBS_MAX_ENTRIES = int(os.environ.get("JOBS_MAX_ENTRIES", "64"))
+JOB_TTL_SECONDS = float(os.environ.get("JOB_TTL_SECONDS", "300"))
+JOB_MAX_WAIT_SECONDS = float(os.environ.get("JOB_MAX_WAIT_SECONDS", "30"))
+JOB_KEEPALIVE_SECONDS = 15
+job_store = JobStore(JOBS_MAX_ENTRIES, JOB_TTL_SECONDS)
+
+# Concurrent requests are grouped into one Grounding DINO forward pass of up to
+# GDINO_MAX_BATCH images, waiting at most GDINO_MAX_WAIT_MS for the batch to fill.
+GDINO_MAX_BATCH = int(os.environ.get("GDINO_MAX_BATCH", "8"))
+GDINO_MAX_WAIT_MS = float(os.environ.get("GDINO_MAX_WAIT_MS", "15"))
+
+# Prompt tokens, and the text encoder output where the model allows it, are computed
+# once per category combination instead of on every request. GDINO_TEXT_CACHE=0
+# keeps the tokens cached but always runs the text encoder.
+GDINO_TEXT_CACHE = os.environ.get("GDINO_TEXT_CACHE", "1") != "0"
+
+# Grounding DINO inference backend: eager (fp32 PyTorch), int8 (dynamic quantization,
+# CPU only), compile (torch.compile) or onnx (ONNX Runtime; the graph is exported to
+# GDINO_ONNX_PATH on first start). Unavailable backends fall back to eager.
+GDINO_BACKEND = os.environ.get("GDINO_BACKEND", "eager")
+GDINO_ONNX_PATH = os.environ.get("GDINO_ONNX_PATH", "gdino.onnx")
+
+# Opt-in tiled detection for panoramas and very large photos: GDINO_TILE_SIZE > 0 splits
+# the detection copy into overlapping tiles that go through the batcher like separate
+# images, plus one pass over the whole frame. Raise DETECT_MAX_SIDE (or set it to 0)
+# along with it, otherwise the detection copy is already small enough to be one tile.
+# GDINO_TILE_OVERLAP is the fraction neighbouring tiles share, 0 <= overlap < 1; the
+# server refuses to start with anything else.
+GDINO_TILE_SIZE = int(os.environ.get("GDINO_TILE_SIZE", "0"))
+GDINO_TILE_OVERLAP = float(os.environ.get("GDINO_TILE_OVERLAP", "0.2"))
 
-async def load_models_async():
-    global models_loaded, processor, gdino_model, ocr_model
-    if not models_loaded:
-        processor, gdino_model = load_gdino(device)
-        ocr_model = try_ocr()
-        models_loaded = True
+# Detector routing per category, as "category=stage+stage,..." overrides of
+# core.pipeline.DEFAULT_ROUTES. By default faces go to the OpenCV face detector and
+# skip Grounding DINO; CASCADE_ROUTES="faces=gdino" restores the old behaviour, and
+# "sign=gdino+ocr_regions" limits OCR to text-like crops. FACE_MODEL points at a
+# YuNet ONNX file for the face stage (needed on OpenCV 5, which has no Haar cascades);
+# the server refuses to start if it cannot be loaded.
+CASCADE_ROUTES = parse_routes(os.environ.get("CASCADE_ROUTES", ""))
+FACE_MODEL = os.environ.get("FACE_MODEL")
+
+# The models, warmup and detection stages live in core.pipeline; this module only
+# adds HTTP, the detection cache and metrics. Labels are not filtered here, since
+# the app's category prompts ("human faces", ...) pick what gets redacted.
+pipeline = RedactionPipeline(
+    backend=GDINO_BACKEND, onnx_path=GDINO_ONNX_PATH, detect_max_side=DETECT_MAX_SIDE,
+    max_pixels=MAX_IMAGE_PIXELS, tile_size=GDINO_TILE_SIZE, tile_overlap=GDINO_TILE_OVERLAP,
+    max_batch=GDINO_MAX_BATCH, max_wait_ms=GDINO_MAX_WAIT_MS, text_cache=GDINO_TEXT_CACHE,
+    routes=CASCADE_ROUTES, face_model=FACE_MODEL, pool=inference_pool,
+    stage_timer=lambda stage: STAGE_SECONDS.time(stage=stage),
+    on_batch_wait=lambda s: QUEUE_WAIT_SECONDS.observe(s, queue="gdino_batch"),
+    on_load=lambda model, s: MODEL_LOAD_SECONDS.set(s, model=model),
+)
+
+def preload_weights():
+    # Called by serve.py --preload in the supervisor before forking the model workers
+    pipeline.preload_weights()
+
+def use_model_client(client):
+    # Set by serve.py in each HTTP front process: the models then live in separate
+    # model-worker processes, and detection goes to them through shared memory.
+    pipeline.use_model_client(client)
+
+def model_worker_ops(worker_device, cores):
+    # serve.py model-worker init (see core.procpool.worker_main)
+    return pipeline.worker_ops(worker_device, cores)
 
 @app.on_event("startup")
 async def startup_event():
-    await load_models_async()
+    await pipeline.start()
+    await pipeline.load_async()
+
+@app.get("/ready")
+async def ready_endpoint():
+    if pipeline.model_client is not None:
+        workers_ready = pipeline.model_client.workers_ready()
+        content = {"ready": workers_ready > 0, "model_workers_ready": workers_ready,
+                   "model_workers": pipeline.model_client.n_workers}
+        return JSONResponse(content=content, status_code=200 if workers_ready > 0 else 503)
+    content = {"ready": pipeline.loaded, "models": pipeline.status, "ocr_available": pipeline.ocr_model is not None,
+               "gdino_backend": pipeline.gdino_backend}
+    return JSONResponse(content=content, status_code=200 if pipeline.loaded else 503)
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    await job_store.aclose()
+    await pipeline.aclose()
+    inference_pool.shutdown()
+    stop_logging()
+
+# The JSON endpoints below are kept for existing dashboards; the same numbers are
+# exported on /metrics as geosafe_gdino_*, geosafe_pool_* and geosafe_cache_*.
+for _name, _help, _read in [
+    ("geosafe_gdino_queue_depth", "Requests waiting for a Grounding DINO batch.",
+     lambda: pipeline.batcher.metrics()["queue_depth"]),
+    ("geosafe_gdino_avg_batch_size", "Mean images per Grounding DINO forward pass.",
+     lambda: pipeline.batcher.metrics()["avg_batch_size"]),
+    ("geosafe_pool_admitted", "Requests currently admitted to the inference pool.",
+     lambda: inference_pool.metrics()["admitted"]),
+    ("geosafe_cache_entries", "Detections held in the cache.", lambda: detection_cache.metrics()["entries"]),
+    ("geosafe_cache_bytes", "Approximate size of the detection cache.", lambda: detection_cache.metrics()["bytes"]),
+    ("geosafe_jobs", "Jobs held in the job store, running or finished.", lambda: job_store.metrics()["jobs"]),
+    ("geosafe_jobs_running", "Jobs queued or running.", lambda: job_store.metrics()["running"]),
+]:
+    metrics.gauge(_name, _help, fn=_read)
+for _name, _help, _read in [
+    ("geosafe_gdino_batches_total", "Grounding DINO forward passes.", lambda: pipeline.batcher.metrics()["batches"]),
+    ("geosafe_gdino_items_total", "Images sent through Grounding DINO.", lambda: pipeline.batcher.metrics()["items"]),
+    ("geosafe_pool_rejected_total", "Requests rejected with 503 because the pool was full.",
+     lambda: inference_pool.metrics()["rejected"]),
+    ("geosafe_cache_hits_total", "Detection cache hits.", lambda: detection_cache.metrics()["hits"]),
+    ("geosafe_cache_misses_total", "Detection cache misses.", lambda: detection_cache.metrics()["misses"]),
+    ("geosafe_cache_evictions_total", "Detection cache evictions.", lambda: detection_cache.metrics()["evictions"]),
+    ("geosafe_jobs_submitted_total", "Jobs started.", lambda: job_store.metrics()["submitted"]),
+    ("geosafe_jobs_deduplicated_total", "Submissions answered with an existing job through their idempotency key.",
+     lambda: job_store.metrics()["deduplicated"]),
+    ("geosafe_jobs_failed_total", "Jobs that ended in an error.", lambda: job_store.metrics()["failed"]),
+    ("geosafe_text_cache_hits_total", "Grounding DINO text feature cache hits.",
+     lambda: pipeline.text_feature_cache.hits if pipeline.text_feature_cache is not None else 0),
+    ("geosafe_text_cache_misses_total", "Grounding DINO text feature cache misses.",
+     lambda: pipeline.text_feature_cache.misses if pipeline.text_feature_cache is not None else 0),
+]:
+    metrics.counter(_name, _help, fn=_read)
+
+@app.get("/metrics")
+async def metrics_endpoint():
+    return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4")
+
+@app.get("/metrics/gdino")
+async def gdino_metrics_endpoint():
+    content = pipeline.batcher.metrics()
+    text_cache = pipeline.text_feature_cache
+    if text_cache is not None:
+        content["text_cache_hits"] = text_cache.hits
+        content["text_cache_misses"] = text_cache.misses
+    return JSONResponse(content=content)
+
+@app.get("/metrics/pool")
+async def pool_metrics_endpoint():
+    return JSONResponse(content=inference_pool.metrics())
+
+@app.get("/metrics/cache")
+async def cache_metrics_endpoint():
+    return JSONResponse(content=detection_cache.metrics())
+
+# Output encoding (see core.pipeline.IMAGE_FORMATS). Clients can override format/quality per request; DEBUG_OUTPUT_DIR,
+# when set, keeps a copy of every result on disk (off by default, it is slow and racy).
+DEFAULT_QUALITY = int(os.environ.get("IMAGE_QUALITY", "90"))
+DEBUG_OUTPUT_DIR = os.environ.get("DEBUG_OUTPUT_DIR")
+
+def render_options(method, blur_ksize, mosaic_scale, image_format, quality):
+    if image_format not in IMAGE_FORMATS:
+        raise HTTPException(status_code=400, detail=f"image_format must be one of {sorted(IMAGE_FORMATS)}")
+    if not 1 <= quality <= 100:
+        raise HTTPException(status_code=400, detail="quality must be between 1 and 100")
+    return {"method": method, "blur_ksize": blur_ksize, "mosaic_scale": mosaic_scale,
+            "image_format": image_format, "quality": quality}
+
+def save_debug_output(encoded, detection_id, render):
+    # One file per detection and setting, so concurrent requests never write the same path
+    ext = IMAGE_FORMATS[render["image_format"]][0]
+    name = f"{detection_id[:16]}_{render['method']}_{render['blur_ksize']}_{render['mosaic_scale']}{ext}"
+    os.makedirs(DEBUG_OUTPUT_DIR, exist_ok=True)
+    with open(os.path.join(DEBUG_OUTPUT_DIR, name), "wb") as f:
+        f.write(encoded)
+
+async def render_detection(img_bgr, detection, detection_id, render):
+    encoded = await pipeline.render_async(img_bgr, detection["boxes"], **render)
+    if DEBUG_OUTPUT_DIR:
+        await inference_pool.run(save_debug_output, encoded, detection_id, render)
+    return encoded
 
 class ProcessImageResponse(BaseModel):
     redacted_image: str
+    detection_id: Optional[str] = None
 
+def http_error(e):
+    # The HTTP error a failed request or job is reported as
+    if isinstance(e, HTTPException):
+        return e
+    if isinstance(e, ingest.ImageRejected):
+        return HTTPException(status_code=413, detail=str(e))
+    if isinstance(e, IdempotencyConflict):
+        return HTTPException(status_code=422, detail=str(e))
+    if isinstance(e, PoolSaturated):
+        return HTTPException(status_code=503, detail=str(e), headers={"Retry-After": str(e.retry_after)})
+    return HTTPException(status_code=500, detail=str(e))
+
+def log_error(e, status):
+    if status == 503:
+        log.warning("Rejecting request: %s", e)
+    elif status == 500:
+        log.exception("An error occurred: %s", e)
+
+# response_format="json" (default) returns the image as a base64 data URI inside JSON;
+# response_format="binary" returns the raw image bytes with the prediction in X- headers.
+# This is a wrapper over the job API below: the job keeps running if the client drops
+# the connection, and a retry with the same Idempotency-Key waits for that job.
 @app.post("/process_image", response_model=ProcessImageResponse)
 async def process_image_endpoint(
     image: UploadFile = File(...),
     method: str = Form("blur"),
     blur_ksize: int = Form(151),
     mosaic_scale: float = Form(0.06),
-    query: str = Form([])
+    query: str = Form([]),
+    response_format: str = Form("json"),
+    image_format: str = Form("jpeg"),
+    quality: int = Form(DEFAULT_QUALITY),
+    idempotency_key: Optional[str] = Header(None)
 ):
+    start, status, cache = time.perf_counter(), 500, "miss"
     try:
-        # Load models if not already loaded
-        await load_models_async()
-        # Parse the JSON string back into a Python list
-        received_query = json.loads(query)
-        print(f"Received query from frontend: {received_query}")
-        geo_model = GeoCLIP()
-        # Read the uploaded image file's content
-        image_bytes = await image.read()
-        print("Received image data from frontend.", file=sys.stderr)
-        
-        # Process the image
-        img_bgr = load_image(image_bytes)
-        img_pil = Image.fromarray(cv2.cvtColor(img_bgr, cv2.COLOR_BGR2RGB))
-        with tempfile.NamedTemporaryFile(delete=False, suffix=".jpg") as tmp:
-            tmp.write(image_bytes)
-            tmp_path = tmp.name
-
-        top_pred_gps, top_pred_prob = geo_model.predict(tmp_path, top_k=1)
-        # queries = ["street name sign", "road name sign", "flag", "landmark", "monument", "person", "child"]
-        queries = []
-        if "flag" in received_query:
-            queries.extend(["flag", "country flags", "state flags"])
-        if "sign" in received_query:
-            queries.extend(["street name sign", "road name sign"])
-        if 'faces' in received_query:
-            queries.extend(["human faces", "faces", "people faces", "child faces", "human head", "people head"])
-        if 'landmark' in received_query:
-            queries.extend(["famous landmark", "monument", "historical site", "tourist attraction"])
-        print(queries)
-        boxes_gd, _ = detect_gdino(img_pil, processor, gdino_model, device, 0.25, 0.20, queries)
-        boxes_ocr = detect_ocr_boxes(img_bgr, ocr_model) if ocr_model else np.empty((0, 4), dtype=int)
-        print(top_pred_gps, top_pred_prob)
-        mask = union_masks(img_bgr.shape, [boxes_gd, boxes_ocr])
-        redacted_image = redact(img_bgr, mask, method, blur_ksize, mosaic_scale)
-        k = top_pred_gps.tolist()  # First, convert the tensor to a list
-        print(k)
-        gps = [round(item, 3) for item in k[0]]
-        print(gps)
-        l = top_pred_prob.tolist()
-        print(l)
-        prob = [round(l[0], 3)*100]
-        print(prob)
-        # Encode the redacted image to base64
-        _, img_encoded = cv2.imencode('.jpeg', redacted_image)
-        redacted_image_base64 = base64.b64encode(img_encoded.tobytes()).decode('utf-8')
-        # save the image
-        cv2.imwrite("redacted_output.jpg", redacted_image)
-        return JSONResponse(content={
-                  "redacted_image": f"data:image/jpeg;base64,{redacted_image_base64}",
-                  "predicted_location": {
-                        "gps": gps,
-                        "probability": prob
-                  }
-            })
+        render = render_options(method, blur_ksize, mosaic_scale, image_format, quality)
+        job, _ = await submit_job(image, query, render, idempotency_key)
+        # Shielded, so a dropped connection cancels only this wait, not the job
+        await asyncio.shield(job.task)
+        if job.error is not None:
+            raise http_error(job.error)
+        result, cache = job.result, job.result["cache"]
+        response = image_response(result["encoded"], result, result["detection_id"], image_format, response_format)
+        status = 200
+        return response
+    except HTTPException as e:
+        status = e.status_code
+        raise
+    except Exception as e:
+        error = http_error(e)
+        status = error.status_code
+        log_error(e, status)
+        raise error
+    finally:
+        observe_request("process_image", status, cache, start)
 
+@app.post("/rerender", response_model=ProcessImageResponse)
+async def rerender_endpoint(
+    detection_id: str = Form(...),
+    method: str = Form("blur"),
+    blur_ksize: int = Form(151),
+    mosaic_scale: float = Form(0.06),
+    response_format: str = Form("json"),
+    image_format: str = Form("jpeg"),
+    quality: int = Form(DEFAULT_QUALITY)
+):
+    # Re-applies redaction to a cached detection with new settings, without re-uploading the image
+    start, status = time.perf_counter(), 500
+    try:
+        render = render_options(method, blur_ksize, mosaic_scale, image_format, quality)
+        detection = detection_cache.get(detection_id)
+        if detection is None:
+            raise HTTPException(status_code=404, detail="Unknown or expired detection_id; resubmit the image.")
+        async with inference_pool.admit():
+            img_bgr = await pipeline.decode_async(detection["image_bytes"])
+            encoded = await render_detection(img_bgr, detection, detection_id, render)
+        response = image_response(encoded, detection, detection_id, render["image_format"], response_format)
+        status = 200
+        return response
+    except HTTPException as e:
+        status = e.status_code
+        raise
+    except ingest.ImageRejected as e:
+        status = 413
+        raise HTTPException(status_code=413, detail=str(e))
+    except PoolSaturated as e:
+        status = 503
+        log.warning("Rejecting request: %s", e)
+        raise HTTPException(status_code=503, detail=str(e), headers={"Retry-After": str(e.retry_after)})
     except Exception as e:
-        print(f"An error occurred: {e}", file=sys.stderr)
+        log.exception("An error occurred: %s", e)
         raise HTTPException(status_code=500, detail=str(e))
+    finally:
+        observe_request("rerender", status, "hit" if status == 200 else "miss", start)
+
+def observe_request(endpoint, status, cache, start):
+    elapsed = time.perf_counter() - start
+    REQUESTS.inc(endpoint=endpoint, status=str(status))
+    if status in (200, 202):
+        REQUEST_SECONDS.observe(elapsed, endpoint=endpoint, cache=cache)
+    log.info("%s %d in %.0f ms (cache %s)", endpoint, status, elapsed * 1000, cache)
+
+def image_response(encoded, detection, detection_id, image_format="jpeg", response_format="json"):
+    media_type = IMAGE_FORMATS[image_format][1]
+    if response_format == "binary":
+        return Response(content=encoded, media_type=media_type, headers={
+            "X-Detection-Id": detection_id,
+            "X-Predicted-GPS": ",".join(str(v) for v in detection["gps"]),
+            "X-Predicted-Probability": ",".join(str(v) for v in detection["probability"]),
+        })
+    # Encode the redacted image to base64
+    redacted_image_base64 = base64.b64encode(encoded).decode('utf-8')
+    return JSONResponse(content={
+              "redacted_image": f"data:{media_type};base64,{redacted_image_base64}",
+              "detection_id": detection_id,
+              "predicted_location": {
+                    "gps": detection["gps"],
+                    "probability": detection["probability"]
+              }
+        })
+
+async def redact(image_bytes, categories, detection_id, render, progress):
+    # One job: detection (or a detection cache hit), then the redacted image.
+    # progress(stage, pending) is called as each stage finishes.
+    await pipeline.load_async()
+    detection = detection_cache.get(detection_id)
+    cache = "hit" if detection is not None else "miss"
+    if detection is not None:
+        log.debug("Detection cache hit for %s", detection_id[:12])
+        img_bgr = await pipeline.decode_async(image_bytes)
+        progress("decode", ["render"])
+    else:
+        detection, img_bgr = await pipeline.detect_async(
+            image_bytes, categories, progress=lambda stage, pending: progress(stage, [*pending, "render"]))
+        detection["image_bytes"] = image_bytes
+        nbytes = len(image_bytes) + sum(boxes.nbytes for boxes in detection["boxes"])
+        detection_cache.put(detection_id, detection, nbytes)
+    encoded = await render_detection(img_bgr, detection, detection_id, render)
+    progress("render", [])
+    return {"encoded": encoded, "detection_id": detection_id, "gps": detection["gps"],
+            "probability": detection["probability"], "image_format": render["image_format"], "cache": cache}
+
+async def run_job(job, admission, image_bytes, categories, detection_id, render):
+    start, status, cache = time.perf_counter(), 500, "miss"
+    try:
+        async with admission:
+            result = await redact(image_bytes, categories, detection_id, render, job.progress)
+        status, cache = 200, result["cache"]
+        return result
+    except Exception as e:
+        status = http_error(e).status_code
+        log_error(e, status)
+        raise
+    finally:
+        observe_request("job", status, cache, start)
+
+async def submit_job(image, query, render, idempotency_key=None):
+    """Reads the upload and starts a redaction job; returns (job, created).
+
+    A job already holding idempotency_key is returned as it is, without
+    taking a slot in the inference pool. New jobs are admitted here, so a
+    full pool still answers the submit with a 503.
+    """
+    # Parse the JSON string back into a Python list
+    received_query = json.loads(query)
+    log.debug("Received query from frontend: %s", received_query)
+    # Read the uploaded image file's content
+    image_bytes = await ingest.read_upload(image, MAX_IMAGE_BYTES)
+    detection_id = detection_key(image_bytes, received_query)
+    fingerprint = (detection_id, tuple(sorted(render.items())))
+    job = job_store.find(idempotency_key, fingerprint)
+    if job is not None:
+        return job, False
+    # The admission is held until the job finishes, not just for this request
+    admission = contextlib.AsyncExitStack()
+    await admission.enter_async_context(inference_pool.admit())
+    run = functools.partial(run_job, admission=admission, image_bytes=image_bytes, categories=received_query,
+                            detection_id=detection_id, render=render)
+    job, created = job_store.submit(run, idempotency_key, fingerprint)
+    if not created:
+        await admission.aclose()
+    return job, created
+
+def get_job(job_id):
+    job = job_store.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Unknown or expired job_id; resubmit the image.")
+    return job
+
+def job_status(job):
+    content = job.snapshot()
+    content["status_url"] = f"/jobs/{job.id}"
+    content["events_url"] = f"/jobs/{job.id}/events"
+    content["result_url"] = f"/jobs/{job.id}/result"
+    if job.error is not None:
+        error = http_error(job.error)
+        content["error"] = {"status": error.status_code, "detail": error.detail}
+    return content
+
+@app.post("/jobs", status_code=202)
+async def submit_job_endpoint(
+    image: UploadFile = File(...),
+    method: str = Form("blur"),
+    blur_ksize: int = Form(151),
+    mosaic_scale: float = Form(0.06),
+    query: str = Form([]),
+    image_format: str = Form("jpeg"),
+    quality: int = Form(DEFAULT_QUALITY),
+    idempotency_key: Optional[str] = Header(None)
+):
+    # 202 for a new job, 200 when the Idempotency-Key already has one
+    start, status = time.perf_counter(), 500
+    try:
+        render = render_options(method, blur_ksize, mosaic_scale, image_format, quality)
+        job, created = await submit_job(image, query, render, idempotency_key)
+        status = 202 if created else 200
+        return JSONResponse(content=job_status(job), status_code=status, headers={"Location": f"/jobs/{job.id}"})
+    except HTTPException as e:
+        status = e.status_code
+        raise
+    except Exception as e:
+        error = http_error(e)
+        status = error.status_code
+        log_error(e, status)
+        raise error
+    finally:
+        # Not a DetectionCache lookup, so its own label values: "dedup" when the key matched a job
+        observe_request("jobs", status, "dedup" if status == 200 else "new", start)
+
+@app.get("/jobs/{job_id}")
+async def job_status_endpoint(job_id: str, wait: float = 0, version: Optional[int] = None):
+    # With wait > 0 this long-polls: it answers as soon as the job moves past version
+    # (the current one if not given) or finishes, or after wait seconds at most
+    job = get_job(job_id)
+    if wait > 0 and not job.finished:
+        await job.wait(job.version if version is None else version, min(wait, JOB_MAX_WAIT_SECONDS))
+    return JSONResponse(content=job_status(job))
+
+@app.get("/jobs/{job_id}/events")
+async def job_events_endpoint(job_id: str):
+    # Server-sent events: a "progress" event on every change, then one "done" or
+    # "failed" event, with comment lines in between to keep idle proxies from
+    # closing the stream
+    job = get_job(job_id)
+
+    async def events():
+        version = -1
+        while True:
+            if job.version > version:
+                version = job.version
+                event = job.status if job.finished else "progress"
+                yield f"id: {version}\nevent: {event}\ndata: {json.dumps(job_status(job))}\n\n"
+                if job.finished:
+                    return
+            elif not await job.wait(version, JOB_KEEPALIVE_SECONDS):
+                yield ": keep-alive\n\n"
+    return StreamingResponse(events(), media_type="text/event-stream",
+                             headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+@app.get("/jobs/{job_id}/result", response_model=ProcessImageResponse)
+async def job_result_endpoint(job_id: str, response_format: str = "json"):
+    # The same response /process_image gives; 202 with the job status while it is still running
+    job = get_job(job_id)
+    if job.error is not None:
+        raise http_error(job.error)
+    if not job.finished:
+        return JSONResponse(content=job_status(job), status_code=202, headers={"Retry-After": "1"})
+    result = job.result
+    return image_response(result["encoded"], result, result["detection_id"], result["image_format"], response_format)